@@ -1,7 +1,10 @@
-﻿from typing import Any, Dict, List, Optional, Protocol
+﻿from typing import Any, Dict, FrozenSet, List, Optional, Protocol, Tuple
 
 class ICashFlowRepository(Protocol):
+    def close(self) -> None: ...
+
     # Core periods/company
+    def get_export_context(self) -> Dict[str, Any]: ...
     def get_active_period(self) -> Optional[Dict[str, Any]]: ...
     def get_active_years(self) -> List[Dict[str, Any]]: ...
     def get_months(self) -> List[Dict[str, Any]]: ...
@@ -9,14 +12,25 @@ class ICashFlowRepository(Protocol):
 
     # Categories/codes/values
     def get_categories(self, cash_type: str) -> List[Dict[str, Any]]: ...
+    def get_categories_by_types(self, cash_types: List[str]) -> Dict[int, List[Dict[str, Any]]]: ...
     def get_cash_codes(self, category_code: str) -> List[Dict[str, Any]]: ...
     def get_cash_code_values(self, cash_code: str, year_number: int,
                              include_active: bool, include_orderbook: bool, include_tax_accruals: bool
                              ) -> List[Dict[str, Any]]: ...
+    def get_cash_code_values_batch(self, cash_codes: List[str], year_number: int,
+                                   include_active: bool, include_orderbook: bool, include_tax_accruals: bool
+                                   ) -> Dict[str, List[Dict[str, Any]]]: ...
+    def get_cash_code_values_bulk(self, cash_codes: List[str], year_numbers: List[int],
+                                  include_active: bool, include_orderbook: bool, include_tax_accruals: bool
+                                  ) -> Dict[Tuple[str, int], List[Dict[str, Any]]]: ...
+    def get_category_slice(self, cash_type: str, year_numbers: List[int],
+                           include_active: bool, include_orderbook: bool, include_tax_accruals: bool
+                           ) -> List[Dict[str, Any]]: ...
 
     # Totals/expressions
     def get_category_totals(self) -> List[Dict[str, Any]]: ...
     def get_category_total_codes(self, category_code: str) -> List[Dict[str, Any]]: ...
+    def get_all_category_total_codes(self) -> Dict[str, List[Dict[str, Any]]]: ...
     def get_category_expressions(self) -> List[Dict[str, Any]]: ...
     def get_category_code_from_name(self, name: str) -> Optional[str]: ...
 
@@ -30,6 +44,28 @@ class ICashFlowRepository(Protocol):
     # Bank
     def get_bank_accounts(self) -> List[Dict[str, Any]]: ...
     def get_bank_balances(self, account_code: str) -> List[Dict[str, Any]]: ...
+    def get_all_bank_balances(self) -> Dict[str, List[Dict[str, Any]]]: ...
 
     # Balance sheet
-    def get_balance_sheet(self) -> List[Dict[str, Any]]: ...
\ No newline at end of file
+    def get_balance_sheet(self) -> List[Dict[str, Any]]: ...
+    def get_balance_sheet_rows(self) -> List[Tuple[str, str, int, int, float]]: ...
+
+# Methods the exporter treats as optional; a repository may implement any subset
+OPTIONAL_REPO_METHODS = (
+    "get_export_context",
+    "get_categories_by_type",
+    "get_categories_by_types",
+    "get_category_totals",
+    "get_category_total_codes",
+    "get_category_expressions",
+    "get_category_code_from_name",
+    "get_all_bank_balances",
+    "get_balance_sheet_rows",
+)
+
+def repo_capabilities(repo: Any) -> FrozenSet[str]:
+    """Optional methods available on repo; read from repo._caps when the repository precomputed it."""
+    caps = getattr(repo, "_caps", None)
+    if caps is None:
+        caps = frozenset(m for m in OPTIONAL_REPO_METHODS if hasattr(repo, m))
+    return caps
\ No newline at end of file
@@ -1,139 +1,444 @@
 ﻿# pip install pyodbc
-from typing import Any, Dict, Iterable, List, Optional
+import sys
+from itertools import groupby, repeat
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from data.contracts import repo_capabilities
 from data.enums import CashType
+import threading
 import pyodbc
 
-def _query_all(conn_str: str, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
-    with pyodbc.connect(conn_str) as conn:
-        cur = conn.cursor()
-        cur.execute(sql, params)
-        cols = [c[0] for c in cur.description]
-        return [dict(zip(cols, row)) for row in cur.fetchall()]
+# Let the driver manager reuse ODBC handles across connect() calls (must be set before the first connect)
+pyodbc.pooling = True
 
-def _query_one(conn_str: str, sql: str, params: Iterable[Any] = ()) -> Optional[Dict[str, Any]]:
-    rows = _query_all(conn_str, sql, params)
-    return rows[0] if rows else None
+# Valid CashType codes, and lowercase member names for callers passing "Trade"/"Money"/"Tax"
+_CASH_TYPE_CODES = frozenset(int(e) for e in CashType)
+_CASH_TYPE_NAMES: Dict[str, int] = {e.name.lower(): int(e) for e in CashType}
+
+# SQL text is kept in module constants so every call sends an identical statement
+# (stable text lets SQL Server reuse the cached plan)
+
+# Core periods/company (App schema)
+_SQL_ACTIVE_PERIOD = "SELECT YearNumber, MonthNumber, StartOn, MonthName, Description FROM App.vwActivePeriod"
+_SQL_ACTIVE_YEARS = "SELECT YearNumber, Description, CashStatus FROM App.vwActiveYears ORDER BY YearNumber"
+_SQL_MONTHS = "SELECT MonthNumber, MonthName, StartOn FROM App.vwMonths ORDER BY StartOn"
+_SQL_COMPANY_NAME = "SELECT TOP (1) SubjectName FROM App.vwHomeAccount"
+# The four above as one batch: four result sets in statement order
+_SQL_EXPORT_CONTEXT = ";".join((_SQL_ACTIVE_PERIOD, _SQL_ACTIVE_YEARS, _SQL_MONTHS, _SQL_COMPANY_NAME))
+
+# Categories/codes/values
+_SQL_CATEGORIES = "SELECT CategoryCode, Category, CashPolarityCode, DisplayOrder FROM Cash.fnFlowCategory(?) ORDER BY DisplayOrder, Category"
+# Categories of several cash types in one statement; {values} is one "(?)" per requested type
+_SQL_CATEGORIES_BY_TYPES = (
+    "SELECT t.CashTypeCode, c.CategoryCode, c.Category, c.CashPolarityCode, c.DisplayOrder "
+    "FROM (VALUES {values}) t (CashTypeCode) CROSS APPLY Cash.fnFlowCategory(t.CashTypeCode) c "
+    "ORDER BY t.CashTypeCode, c.DisplayOrder, c.Category"
+)
+_SQL_CASH_CODES = "SELECT CashCode, CashDescription FROM Cash.fnFlowCategoryCashCodes(?) ORDER BY CashDescription"
+# Categories with their cash codes in one statement (OUTER APPLY keeps categories without codes)
+_SQL_CATEGORY_CASH_CODES = (
+    "SELECT c.CategoryCode, c.Category, c.CashPolarityCode, c.DisplayOrder, cc.CashCode, cc.CashDescription "
+    "FROM Cash.fnFlowCategory(?) c OUTER APPLY Cash.fnFlowCategoryCashCodes(c.CategoryCode) cc "
+    "ORDER BY c.DisplayOrder, c.Category, cc.CashDescription"
+)
+# Cash.proc_FlowCashCodeValues returns StartOn, InvoiceValue, InvoiceTax, ForecastValue, ForecastTax;
+# its rows are captured server-side so only MonthNumber + InvoiceValue cross the wire.
+# A batch is one declare followed by one values block per cash code (each block yields one result set).
+_SQL_CASH_CODE_VALUES_DECLARE = (
+    "SET NOCOUNT ON;"
+    "DECLARE @v TABLE (StartOn datetime, InvoiceValue decimal(18,5), InvoiceTax decimal(18,5), ForecastValue decimal(18,5), ForecastTax decimal(18,5));"
+)
+_SQL_CASH_CODE_VALUES_BLOCK = (
+    "DELETE FROM @v;"
+    "INSERT INTO @v EXEC Cash.proc_FlowCashCodeValues ?, ?, ?, ?, ?;"
+    "SELECT CAST(MONTH(StartOn) AS tinyint) AS MonthNumber, InvoiceValue FROM @v ORDER BY StartOn;"
+)
+
+# Totals and expressions
+_SQL_CATEGORY_TOTALS = "SELECT CategoryCode, Category FROM Cash.vwCategoryTotals ORDER BY DisplayOrder, Category"
+_SQL_CATEGORY_TOTAL_CODES = "SELECT CategoryCode AS SourceCategoryCode FROM Cash.fnFlowCategoryTotalCodes(?) ORDER BY CategoryCode"
+# Source codes of every total category in one statement (OUTER APPLY keeps totals without sources)
+_SQL_ALL_CATEGORY_TOTAL_CODES = (
+    "SELECT t.CategoryCode, s.CategoryCode AS SourceCategoryCode "
+    "FROM Cash.vwCategoryTotals t OUTER APPLY Cash.fnFlowCategoryTotalCodes(t.CategoryCode) s "
+    "ORDER BY t.CategoryCode, s.CategoryCode"
+)
+_SQL_CATEGORY_EXPRESSIONS = "SELECT DisplayOrder, CategoryCode, Category, Expression, Format FROM Cash.vwCategoryExpressions WHERE SyntaxTypeCode IN (0,1) ORDER BY DisplayOrder, Category"
+_SQL_CATEGORY_CODE_FROM_NAME = "SELECT CategoryCode FROM Cash.vwFlowCategories WHERE Category = ?"
+_SQL_EVENT_LOG = "{CALL App.proc_EventLog(?, ?, ?)}"
+
+# VAT
+_SQL_VAT_RECURRENCE_TYPE = "SELECT TOP (1) UPPER(Recurrence) AS VatType FROM Cash.vwFlowTaxType WHERE TaxTypeCode = 1"
+_SQL_VAT_RECURRENCE = "SELECT YearNumber, StartOn, HomeSales, HomePurchases, ExportSales, ExportPurchases, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatAdjustment, VatDue FROM Cash.vwFlowVatRecurrence ORDER BY YearNumber, StartOn"
+_SQL_VAT_RECURRENCE_ACCRUALS = "SELECT YearNumber, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatRecurrenceAccruals ORDER BY YearNumber"
+_SQL_VAT_PERIOD_TOTALS = "SELECT YearNumber, StartOn, HomeSales, HomePurchases, ExportSales, ExportPurchases, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatPeriodTotals ORDER BY YearNumber, StartOn"
+_SQL_VAT_PERIOD_ACCRUALS = "SELECT YearNumber, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatPeriodAccruals ORDER BY YearNumber"
+
+# Bank
+_SQL_BANK_ACCOUNTS = "SELECT AccountCode, AccountName FROM Cash.vwBankAccounts ORDER BY DisplayOrder, AccountCode"
+_SQL_BANK_BALANCES = """
+    SELECT
+        YearNumber,
+        CAST(MONTH(StartOn) AS tinyint) AS MonthNumber,
+        CAST(Balance AS decimal(18,5)) AS Balance
+    FROM Cash.fnFlowBankBalances(?)
+    ORDER BY YearNumber, StartOn
+"""
+_SQL_ALL_BANK_BALANCES = """
+    SELECT
+        a.AccountCode,
+        b.YearNumber,
+        CAST(MONTH(b.StartOn) AS tinyint) AS MonthNumber,
+        CAST(b.Balance AS decimal(18,5)) AS Balance
+    FROM Cash.vwBankAccounts a
+    CROSS APPLY Cash.fnFlowBankBalances(a.AccountCode) b
+    ORDER BY a.DisplayOrder, a.AccountCode, b.YearNumber, b.StartOn
+"""
+
+# Balance sheet
+_SQL_BALANCE_SHEET = "SELECT AssetCode, AssetName, YearNumber, MonthNumber, Balance FROM Cash.vwBalanceSheet ORDER BY EntryNumber"
+
+# Rows pulled per driver round trip (the wide VAT and balance sheet views use the larger batch)
+_FETCH_BATCH = 1000
+_FETCH_BATCH_WIDE = 5000
+
+# ODBC SQL_ATTR_PACKET_SIZE: request the largest TDS packet SQL Server accepts, fewer packets per result set
+_SQL_ATTR_PACKET_SIZE = 112
+_PACKET_SIZE = 32767
+
+# Procedure calls per batched statement (5 parameters each, SQL Server allows 2100 per request)
+_BATCH_MAX_CALLS = 400
+
+def _column_names(cur) -> tuple:
+    # Interned so every row dict shares the same key objects as the literals used by callers
+    return tuple(sys.intern(c[0]) for c in cur.description)
 
 class SqlServerRepository:
     def __init__(self, conn_str: str):
         self.conn_str = conn_str
+        # pyodbc connections must not be used concurrently, so each calling thread gets its own
+        self._conns: Dict[int, Any] = {}
+        self._conns_lock = threading.Lock()
+        # Period/company and category-totals metadata memoized per repository (fixed for the life of one export)
+        self._cache: Dict[tuple, Any] = {}
+        # Optional methods this repository offers, resolved once instead of per renderer call
+        self._caps = repo_capabilities(self)
+
+    def __enter__(self) -> "SqlServerRepository":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _get_conn(self):
+        # One connection per thread, opened on first use and shared by every query on that thread
+        key = threading.get_ident()
+        conn = self._conns.get(key)
+        if conn is None:
+            # Autocommit: the export only reads (plus a single event log insert), so no implicit transaction is held open
+            conn = pyodbc.connect(self.conn_str, autocommit=True, attrs_before={_SQL_ATTR_PACKET_SIZE: _PACKET_SIZE})
+            with self._conns_lock:
+                self._conns[key] = conn
+        return conn
+
+    def close(self) -> None:
+        with self._conns_lock:
+            conns = list(self._conns.values())
+            self._conns.clear()
+        for conn in conns:
+            conn.close()
+
+    def invalidate_cache(self) -> None:
+        self._cache.clear()
+
+    def _cached(self, key: tuple, load: Callable[[], Any]) -> Any:
+        if key in self._cache:
+            return self._cache[key]
+        value = self._cache[key] = load()
+        return value
+
+    def _query_all(self, sql: str, params: Iterable[Any] = (), fetch_batch: int = _FETCH_BATCH) -> List[Dict[str, Any]]:
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, params)
+            cols = _column_names(cur)
+            cur.arraysize = fetch_batch
+            out: List[Dict[str, Any]] = []
+            while True:
+                batch = cur.fetchmany(fetch_batch)
+                if not batch:
+                    break
+                # dict(zip(...)) driven by map keeps the per-row loop inside C
+                out.extend(map(dict, map(zip, repeat(cols), batch)))
+            return out
+        finally:
+            cur.close()
+
+    def _query_iter(self, sql: str, params: Iterable[Any] = ()) -> Iterator[Dict[str, Any]]:
+        # Streams rows batch by batch; drain it before issuing another query on this connection
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, params)
+            cols = _column_names(cur)
+            cur.arraysize = _FETCH_BATCH
+            while True:
+                batch = cur.fetchmany(_FETCH_BATCH)
+                if not batch:
+                    break
+                yield from map(dict, map(zip, repeat(cols), batch))
+        finally:
+            cur.close()
+
+    def _query_scalar(self, sql: str, params: Iterable[Any] = ()) -> Any:
+        # First column of the first row, or None when there are no rows
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchval()
+        finally:
+            cur.close()
+
+    def _query_all_rows(self, sql: str, params: Iterable[Any] = ()) -> List[pyodbc.Row]:
+        # Raw rows (column access by name, no dict copy) for callers that read a column or two
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def _query_one(self, sql: str, params: Iterable[Any] = ()) -> Optional[Dict[str, Any]]:
+        # First row only; the rest of the result set is never fetched
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return dict(zip(_column_names(cur), row))
+        finally:
+            cur.close()
 
     def _cash_type_code(self, cash_type: Any) -> int:
-        if isinstance(cash_type, int): return cash_type
-        if isinstance(cash_type, str):
-            s = cash_type.strip()
-            if s.isdigit(): return int(s)
-            m = {"trade": 0, "money": 1, "tax": 2}
-            if s.lower() in m: return m[s.lower()]
-        raise ValueError(f"Unknown cash_type '{cash_type}'. Use numeric code or Trade/Money/Tax.")
+        # Enum members, ints and numeric strings all go through int(); only names need the lookup
+        try:
+            code = int(cash_type)
+        except (TypeError, ValueError):
+            code = _CASH_TYPE_NAMES.get(str(cash_type).strip().lower())
+        if code not in _CASH_TYPE_CODES:
+            raise ValueError(f"Unknown cash_type '{cash_type}'. Use numeric code or Trade/Money/Tax.")
+        return code
 
     # Core periods/company (App schema)
+    def get_export_context(self) -> Dict[str, Any]:
+        # Active period, active years, months and company name in one round trip; years, months and
+        # company name also fill the caches behind their own getters
+        result_sets: List[List[Dict[str, Any]]] = []
+        cur = self._get_conn().cursor()
+        try:
+            cur.execute(_SQL_EXPORT_CONTEXT)
+            while True:
+                if cur.description is not None:
+                    cols = _column_names(cur)
+                    result_sets.append([dict(zip(cols, row)) for row in cur.fetchall()])
+                if not cur.nextset():
+                    break
+        finally:
+            cur.close()
+        active_rows, years, months, company_rows = result_sets
+        company_name = (company_rows[0]["SubjectName"] if company_rows else None) or ""
+        return {
+            "active": active_rows[0] if active_rows else None,
+            "years": self._cache.setdefault(("get_active_years",), years),
+            "months": self._cache.setdefault(("get_months",), months),
+            "company_name": self._cache.setdefault(("get_company_name",), company_name),
+        }
+
     def get_active_period(self) -> Optional[Dict[str, Any]]:
-        return _query_one(self.conn_str, "SELECT YearNumber, MonthNumber, StartOn, MonthName, Description FROM App.vwActivePeriod")
+        return self._query_one(_SQL_ACTIVE_PERIOD)
 
     def get_active_years(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT YearNumber, Description, CashStatus FROM App.vwActiveYears ORDER BY YearNumber")
+        return self._cached(("get_active_years",), lambda: self._query_all(_SQL_ACTIVE_YEARS))
 
     def get_months(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT MonthNumber, MonthName, StartOn FROM App.vwMonths ORDER BY StartOn")
+        return self._cached(("get_months",), lambda: self._query_all(_SQL_MONTHS))
 
     def get_company_name(self) -> str:
-        row = _query_one(self.conn_str, "SELECT TOP (1) SubjectName FROM App.vwHomeAccount")
-        return row["SubjectName"] if row else ""
+        return self._cached(("get_company_name",), lambda: self._query_scalar(_SQL_COMPANY_NAME) or "")
 
     # Categories/codes/values
     def get_categories(self, cash_type: CashType | int) -> list[dict]:
-        code = int(cash_type)  # IntEnum -> int
-        return _query_all(self.conn_str,
-            "SELECT CategoryCode, Category, CashPolarityCode, DisplayOrder FROM Cash.fnFlowCategory(?) ORDER BY DisplayOrder, Category",
-            (code,))
+        code = self._cash_type_code(cash_type)
+        return self._cached(("get_categories", code), lambda: self._query_all(_SQL_CATEGORIES, (code,)))
+
+    def get_categories_by_types(self, cash_types: Iterable[CashType | int]) -> Dict[int, List[Dict[str, Any]]]:
+        # get_categories for several cash types in one round trip, keyed by cash type code;
+        # the rows also fill the per-type cache so later get_categories calls are free
+        codes = list(dict.fromkeys(self._cash_type_code(ct) for ct in cash_types))
+        missing = [c for c in codes if ("get_categories", c) not in self._cache]
+        if missing:
+            found: Dict[int, List[Dict[str, Any]]] = {c: [] for c in missing}
+            sql = _SQL_CATEGORIES_BY_TYPES.format(values=",".join(["(?)"] * len(missing)))
+            for row in self._query_iter(sql, missing):
+                found[int(row.pop("CashTypeCode"))].append(row)
+            for c, rows in found.items():
+                self._cache[("get_categories", c)] = rows
+        return {c: self._cache[("get_categories", c)] for c in codes}
 
     def get_cash_codes(self, category_code: str) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT CashCode, CashDescription FROM Cash.fnFlowCategoryCashCodes(?) ORDER BY CashDescription", (category_code,))
+        return self._query_all(_SQL_CASH_CODES, (category_code,))
 
     def get_cash_code_values(self, cash_code: str, year_number: int, include_active: bool, include_orderbook: bool, include_tax_accruals: bool) -> List[Dict[str, Any]]:
         # Stored procedure: Cash.proc_FlowCashCodeValues
-        with pyodbc.connect(self.conn_str) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "{CALL Cash.proc_FlowCashCodeValues(?, ?, ?, ?, ?)}",
-                (cash_code, int(year_number), 1 if include_active else 0, 1 if include_orderbook else 0, 1 if include_tax_accruals else 0)
-            )
-            cols = [c[0] for c in cur.description]
-            rows = cur.fetchall()
-        # Expected shape: StartOn, InvoiceValue, InvoiceTax, ForecastValue, ForecastTax
-        # Project to MonthNumber + InvoiceValue for ODS categories (month alignment)
-        result = []
-        for r in rows:
-            row = dict(zip(cols, r))
-            # MonthNumber from StartOn
-            start_on = row.get("StartOn")
-            month_num = start_on.month if hasattr(start_on, "month") else None
-            result.append({
-                "MonthNumber": month_num,
-                "InvoiceValue": row.get("InvoiceValue", 0)
-            })
+        return self.get_cash_code_values_batch([cash_code], year_number, include_active, include_orderbook, include_tax_accruals).get(cash_code, [])
+
+    def get_cash_code_values_batch(self, cash_codes: List[str], year_number: int, include_active: bool, include_orderbook: bool, include_tax_accruals: bool) -> Dict[str, List[Dict[str, Any]]]:
+        # Same data as get_cash_code_values for many codes of one year in one round trip
+        bulk = self.get_cash_code_values_bulk(cash_codes, [year_number], include_active, include_orderbook, include_tax_accruals)
+        return {code: values for (code, _), values in bulk.items()}
+
+    def get_cash_code_values_bulk(self, cash_codes: List[str], year_numbers: Iterable[int], include_active: bool, include_orderbook: bool, include_tax_accruals: bool) -> Dict[Tuple[str, int], List[Dict[str, Any]]]:
+        # Values for every (cash code, year) pair, keyed by that pair. The procedure is executed once per
+        # pair inside a single batch and each call returns its own result set, so a whole cash type across
+        # all years costs one round trip (per _BATCH_MAX_CALLS pairs)
+        flags = (1 if include_active else 0, 1 if include_orderbook else 0, 1 if include_tax_accruals else 0)
+        pairs = [(code, int(year)) for year in year_numbers for code in cash_codes]
+        result: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+        for start in range(0, len(pairs), _BATCH_MAX_CALLS):
+            chunk = pairs[start:start + _BATCH_MAX_CALLS]
+            sql = _SQL_CASH_CODE_VALUES_DECLARE + _SQL_CASH_CODE_VALUES_BLOCK * len(chunk)
+            params = [p for pair in chunk for p in (*pair, *flags)]
+            cur = self._get_conn().cursor()
+            try:
+                cur.execute(sql, params)
+                pending = iter(chunk)
+                while True:
+                    # Skip any row-count results; only row-returning sets belong to a pair
+                    if cur.description is not None:
+                        result[next(pending)] = self._project_cash_code_values(cur)
+                    if not cur.nextset():
+                        break
+            finally:
+                cur.close()
         return result
 
+    def get_category_slice(self, cash_type: CashType | int, year_numbers: Iterable[int], include_active: bool, include_orderbook: bool, include_tax_accruals: bool) -> List[Dict[str, Any]]:
+        # Categories -> cash codes -> values for a whole cash type: one query for the category/code
+        # tree plus one bulk values call for every code and year, instead of a round trip per category and code.
+        # Each category carries "CashCodes"; each code carries "Values" keyed by year number.
+        code = self._cash_type_code(cash_type)
+        categories: List[Dict[str, Any]] = []
+        by_category: Dict[str, Dict[str, Any]] = {}
+        cash_codes: List[Dict[str, Any]] = []
+        for row in self._query_iter(_SQL_CATEGORY_CASH_CODES, (code,)):
+            cat = by_category.get(row["CategoryCode"])
+            if cat is None:
+                cat = by_category[row["CategoryCode"]] = {
+                    "CategoryCode": row["CategoryCode"],
+                    "Category": row["Category"],
+                    "CashPolarityCode": row["CashPolarityCode"],
+                    "DisplayOrder": row["DisplayOrder"],
+                    "CashCodes": [],
+                }
+                categories.append(cat)
+            if row["CashCode"] is not None:
+                cash_code = {"CashCode": row["CashCode"], "CashDescription": row["CashDescription"], "Values": {}}
+                cat["CashCodes"].append(cash_code)
+                cash_codes.append(cash_code)
+
+        if cash_codes:
+            year_list = [int(y) for y in year_numbers]
+            values = self.get_cash_code_values_bulk([c["CashCode"] for c in cash_codes], year_list, include_active, include_orderbook, include_tax_accruals)
+            for c in cash_codes:
+                for year_number in year_list:
+                    c["Values"][year_number] = values.get((c["CashCode"], year_number), [])
+        return categories
+
+    def _project_cash_code_values(self, cur) -> List[Dict[str, Any]]:
+        # Expected shape: MonthNumber, InvoiceValue (month already extracted by the SQL block).
+        # InvoiceValue is coalesced to a float here, once per row, instead of in every consumer.
+        return [
+            {"MonthNumber": month, "InvoiceValue": float(value) if value is not None else 0.0}
+            for month, value in cur.fetchall()
+        ]
+
     # Totals and expressions
     def get_category_totals(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT CategoryCode, Category FROM Cash.vwCategoryTotals ORDER BY DisplayOrder, Category")
+        return self._cached(("get_category_totals",), lambda: self._query_all(_SQL_CATEGORY_TOTALS))
 
     def get_category_total_codes(self, category_code: str) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT CategoryCode AS SourceCategoryCode FROM Cash.fnFlowCategoryTotalCodes(?) ORDER BY CategoryCode", (category_code,))
+        # Served from the one-round-trip map; codes outside Cash.vwCategoryTotals still get their own query
+        by_total = self.get_all_category_total_codes()
+        if category_code in by_total:
+            return by_total[category_code]
+        return self._cached(("get_category_total_codes", category_code), lambda: self._query_all(_SQL_CATEGORY_TOTAL_CODES, (category_code,)))
+
+    def get_all_category_total_codes(self) -> Dict[str, List[Dict[str, Any]]]:
+        # get_category_total_codes for every total category, keyed by CategoryCode
+        def load() -> Dict[str, List[Dict[str, Any]]]:
+            out: Dict[str, List[Dict[str, Any]]] = {}
+            for code, source_code in self._query_all_rows(_SQL_ALL_CATEGORY_TOTAL_CODES):
+                sources = out.setdefault(code, [])
+                if source_code is not None:
+                    sources.append({"SourceCategoryCode": source_code})
+            return out
+        return self._cached(("get_all_category_total_codes",), load)
 
     def get_category_expressions(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT DisplayOrder, CategoryCode, Category, Expression, Format FROM Cash.vwCategoryExpressions WHERE SyntaxTypeCode IN (0,1) ORDER BY DisplayOrder, Category")
+        return self._query_all(_SQL_CATEGORY_EXPRESSIONS)
 
     def get_category_code_from_name(self, name: str) -> Optional[str]:
-        row = _query_one(self.conn_str, "SELECT CategoryCode FROM Cash.vwFlowCategories WHERE Category = ?", (name,))
-        return row["CategoryCode"] if row else None
+        # Memoized per name: expressions repeat the same [Name] references. Matching stays in SQL
+        # (server collation decides case/trailing-space equality), so no client-side name map
+        return self._cached(("get_category_code_from_name", name), lambda: self._query_scalar(_SQL_CATEGORY_CODE_FROM_NAME, (name,)))
 
     def set_category_expression_status(self, category_code: str, is_error: bool, message: Optional[str] = None) -> None:
         # Minimal implementation: write to App.proc_EventLog (Error=0, Information=2)
         event_type = 0 if is_error else 2
         msg = f"Expression {category_code}: {message or 'OK'}"
-        with pyodbc.connect(self.conn_str) as conn:
-            cur = conn.cursor()
-            # LogCode is OUTPUT in SQL; we can ignore it here
-            cur.execute("{CALL App.proc_EventLog(?, ?, ?)}", (msg, event_type, None))
-            conn.commit()
+        cur = self._get_conn().cursor()
+        try:
+            # LogCode is OUTPUT in SQL; we can ignore it here (autocommit connection, no explicit commit)
+            cur.execute(_SQL_EVENT_LOG, (msg, event_type, None))
+        finally:
+            cur.close()
 
     # VAT
     def get_vat_recurrence_type(self) -> str:
-        row = _query_one(self.conn_str, "SELECT TOP (1) UPPER(Recurrence) AS VatType FROM Cash.vwFlowTaxType WHERE TaxTypeCode = 1")
-        return row["VatType"] if row else ""
+        return self._query_scalar(_SQL_VAT_RECURRENCE_TYPE) or ""
 
     def get_vat_recurrence(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT YearNumber, StartOn, HomeSales, HomePurchases, ExportSales, ExportPurchases, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatAdjustment, VatDue FROM Cash.vwFlowVatRecurrence ORDER BY YearNumber, StartOn")
+        return self._query_all(_SQL_VAT_RECURRENCE, fetch_batch=_FETCH_BATCH_WIDE)
 
     def get_vat_recurrence_accruals(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT YearNumber, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatRecurrenceAccruals ORDER BY YearNumber")
+        return self._query_all(_SQL_VAT_RECURRENCE_ACCRUALS)
 
     def get_vat_period_totals(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT YearNumber, StartOn, HomeSales, HomePurchases, ExportSales, ExportPurchases, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatPeriodTotals ORDER BY YearNumber, StartOn")
+        return self._query_all(_SQL_VAT_PERIOD_TOTALS, fetch_batch=_FETCH_BATCH_WIDE)
 
     def get_vat_period_accruals(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT YearNumber, HomeSalesVat, HomePurchasesVat, ExportSalesVat, ExportPurchasesVat, VatDue FROM Cash.vwFlowVatPeriodAccruals ORDER BY YearNumber")
+        return self._query_all(_SQL_VAT_PERIOD_ACCRUALS)
 
     # Bank
     def get_bank_accounts(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT AccountCode, AccountName FROM Cash.vwBankAccounts ORDER BY DisplayOrder, AccountCode")
+        return self._query_all(_SQL_BANK_ACCOUNTS)
 
     def get_bank_balances(self, account_code: str) -> List[Dict[str, Any]]:
-        return _query_all(
-            self.conn_str,
-            """
-            SELECT 
-                YearNumber,
-                CAST(MONTH(StartOn) AS tinyint) AS MonthNumber,
-                CAST(Balance AS decimal(18,5)) AS Balance
-            FROM Cash.fnFlowBankBalances(?)
-            ORDER BY YearNumber, StartOn
-            """,
-            (account_code,)
-        )
+        return self._query_all(_SQL_BANK_BALANCES, (account_code,))
+
+    def get_all_bank_balances(self) -> Dict[str, List[Dict[str, Any]]]:
+        # get_bank_balances for every account in one round trip, keyed by AccountCode
+        rows = self._query_all(_SQL_ALL_BANK_BALANCES)
+        return {code: list(group) for code, group in groupby(rows, key=itemgetter("AccountCode"))}
 
     # Balance sheet
     def get_balance_sheet(self) -> List[Dict[str, Any]]:
-        return _query_all(self.conn_str, "SELECT AssetCode, AssetName, YearNumber, MonthNumber, Balance FROM Cash.vwBalanceSheet ORDER BY EntryNumber")
\ No newline at end of file
+        return self._query_all(_SQL_BALANCE_SHEET, fetch_batch=_FETCH_BATCH_WIDE)
+
+    def get_balance_sheet_rows(self) -> List[Tuple[str, str, int, int, float]]:
+        # Same data as get_balance_sheet as plain (AssetCode, AssetName, YearNumber, MonthNumber, Balance)
+        # tuples with numeric columns already converted, so report math skips the per-row dict
+        return [
+            (r[0], r[1], int(r[2]), int(r[3]), float(r[4] or 0))
+            for r in self._query_all_rows(_SQL_BALANCE_SHEET)
+        ]
\ No newline at end of file
@@ -1,88 +1,145 @@
 ﻿# pip install pyodbc odfdo
-import json, sys, io, base64
+import json, os, sys, io, base64, re, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Union
 
+from lxml import etree
 from odfdo import Document, Settings, Style
-from odfdo.table import Table, Row, Cell, Column
 from odfdo.element import Element
 
+try:
+    import orjson  # optional: faster payload parsing, stdlib json otherwise
+except ImportError:
+    orjson = None
+
+from data.contracts import repo_capabilities
 from data.enums import CashType
 from data.factory import create_repo
-from i18n.resources import ResourceManager
-from style_factory import apply_styles_bytes
+from i18n.resources import ResourceManager, get_resource_manager
+from style_factory import apply_styles_parts
+
+_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 def _col_letter(index_1based: int) -> str:
+    # Bijective base-26: collect letters least-significant first, join once
+    letters = []
     dividend = index_1based
-    name = ""
     while dividend > 0:
-        modulo = (dividend - 1) % 26
-        name = chr(65 + modulo) + name
-        dividend = (dividend - modulo) // 26
-    return name
+        dividend, modulo = divmod(dividend - 1, 26)
+        letters.append(_ALPHABET[modulo])
+    return "".join(reversed(letters))
+
+# Column letters by 1-based index, computed once for A..AMJ (Calc's classic 1024-column sheet width)
+_COL_LETTERS: list[str] = [""] + [_col_letter(i) for i in range(1, 1025)]
+
+# Cells are emitted as ready-made XML fragments; the finished sheet is spliced into content.xml as text (see save_cashflow)
+EMPTY_CELL = "<table:table-cell/>"
+COVERED_CELL = "<table:covered-table-cell/>"
+EMPTY_ROW = "<table:table-row/>"
+
+_XML_TEXT_SPECIALS = re.compile(r"[&<>]")
+_XML_ATTR_SPECIALS = re.compile(r'[&<>"]')
+_XML_ESCAPES = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}
+
+# Expression normalisation: lowercase if( -> IF(
+_IF_RE = re.compile(r"\bif\s*\(", re.IGNORECASE)
+# [Name] references in category expressions
+_TOKEN_RE = re.compile(r"\[([^\]]+)\]")
+# CASHn_CELL style names, optionally already stamped _POS/_NEG
+_CASH_STYLE_RE = re.compile(r"^(CASH.*?)(_POS|_NEG)?_CELL$")
+
+def _xml_text(value: str) -> str:
+    # Escape only when needed; most labels and codes have nothing to escape
+    if _XML_TEXT_SPECIALS.search(value) is None:
+        return value
+    return _XML_TEXT_SPECIALS.sub(lambda m: _XML_ESCAPES[m.group()], value)
+
+def _xml_attr(value: str) -> str:
+    if _XML_ATTR_SPECIALS.search(value) is None:
+        return value
+    return _XML_ATTR_SPECIALS.sub(lambda m: _XML_ESCAPES[m.group()], value)
+
+class SheetRow:
+    """
+    One table row being assembled: a list of cell XML fragments.
+    """
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells: list[str] = []
 
-# def _empty_cell(style: Optional[str] = None) -> Element:
-#     # Truly empty cell: no text:p child
-#     e = Element.from_tag("table:table-cell")
-#     if style:
-#         e.set_attribute("table:style-name", style)
-#     return e
+    def append(self, cell_xml: str) -> None:
+        self.cells.append(cell_xml)
 
-def add_spanned_text_cell(row: Row, text: str, span: int = 1, style: Optional[str] = None) -> None:
+def add_empty_cell(row: SheetRow, style: Optional[str] = None) -> None:
+    # Truly empty cell: no text:p child
+    if style:
+        row.append(f'<table:table-cell table:style-name="{_xml_attr(style)}"/>')
+    else:
+        row.append(EMPTY_CELL)
+
+def add_empty_cells(row: SheetRow, count: int) -> None:
+    # Run of unstyled empty cells; every one is the same shared fragment
+    if count > 0:
+        row.cells.extend([EMPTY_CELL] * count)
+
+def add_spanned_text_cell(row: SheetRow, text: str, span: int = 1, style: Optional[str] = None) -> None:
     # Create a table cell with text and span it across span columns.
-    tc = Element.from_tag("table:table-cell")
+    attrs = ""
     if style:
-        tc.set_attribute("table:style-name", style)
+        attrs += f' table:style-name="{_xml_attr(style)}"'
     if span and span > 1:
-        tc.set_attribute("table:number-columns-spanned", str(span))
-    p = Element.from_tag("text:p")
-    p.text = str(text or "")
-    tc.append(p)
-    row.append(tc)
+        attrs += f' table:number-columns-spanned="{span}"'
+    row.append(f"<table:table-cell{attrs}><text:p>{_xml_text(str(text or ''))}</text:p></table:table-cell>")
     # For each additional spanned column, add a covered cell (never contains text:p)
-    for _ in range(max(0, span - 1)):
-        row.append(Element.from_tag("table:covered-table-cell"))
+    if span > 1:
+        row.cells.extend([COVERED_CELL] * (span - 1))
 
-def add_text_cell(row: Row, text: str, style: Optional[str] = None):
+@lru_cache(maxsize=4096)
+def _text_cell_xml(text: str, style: Optional[str]) -> str:
+    # Escaped cell fragment per (text, style); labels, month names and codes repeat across rows and year blocks
+    if style:
+        return f'<table:table-cell table:style-name="{_xml_attr(style)}"><text:p>{_xml_text(text)}</text:p></table:table-cell>'
+    return f"<table:table-cell><text:p>{_xml_text(text)}</text:p></table:table-cell>"
+
+def add_text_cell(row: SheetRow, text: str, style: Optional[str] = None):
     # If there is actual text, create a normal cell
     if text is not None and str(text).strip() != "":
-        cell = Cell(text=str(text))
-        if style:
-            cell.set_attribute("table:style-name", style)
-        row.append(cell)
+        row.append(_text_cell_xml(str(text), style))
     else:
-        # Method 5
-        # append a raw empty table cell (no text:p)
-        # row.append(_empty_cell(style))
-
-        # Method 4
-        # empty = Element.from_tag("table:table-cell")
-        # if style:
-        #     empty.set_attribute("table:style-name", style)
-        # Do NOT add any text child
-        # row.append(empty)
-
-        # Method 3
-        # cell = Cell()
-        # row.append(cell)
-        
-        # last_cell = row.get_cells()[-1]
-        # paragraphs = last_cell.get_elements('text:p')
-        # for p in paragraphs:
-        #     last_cell.delete_element(p)
-
-        # Method 2
-        #cell = Cell(text=None)
-        #for p in cell.get_elements('text:p'):
-        #    cell.delete_element(p)
-        #row.append(cell)
-
-        # Method 1
-        null_cell = Element.from_tag('table:table-cell')
-        row.append(null_cell)
-
-def add_number_cell(row: Row, value: float = None, style: Optional[str] = None, formula: str = None, display_text: str = None):
+        # Blank text: a raw empty table cell (no text:p, no style)
+        row.append(EMPTY_CELL)
+
+def _resolve_cash_style(base: str, is_negative: bool) -> str:
+    u = (base or "").strip().upper()
+    m = _CASH_STYLE_RE.match(u)
+    if m is None:
+        return base or "CASH0_CELL"
+    if m.group(2):
+        return u
+    return f"{m.group(1)}{'_NEG_CELL' if is_negative else '_POS_CELL'}"
+
+# (base style, is_negative) -> escaped stamped style name. Only a handful of style codes occur in a
+# sheet, so every numeric cell after the first of its kind resolves with one dict lookup
+_CASH_STYLE_NAMES: dict[tuple[str, bool], str] = {}
+
+def _cash_style_name(base: str, is_negative: bool) -> str:
+    key = (base, is_negative)
+    name = _CASH_STYLE_NAMES.get(key)
+    if name is None:
+        name = _CASH_STYLE_NAMES[key] = _xml_attr(_resolve_cash_style(base, is_negative))
+    return name
+
+def _formula_is_negative(formula: str) -> bool:
+    # Heuristic: detect simple negative formulas
+    f = formula.strip().upper()
+    # negatives like "-A1", "A1*-1", "SUM(...)*-1", "(-A1)", etc.
+    return f.startswith("-") or "*-1" in f or "=-" in f
+
+def add_number_cell(row: SheetRow, value: float = None, style: Optional[str] = None, formula: str = None, display_text: str = None):
     """
     Write a numeric or formula cell that Calc treats as numeric.
     - numeric: office:value-type="float" and office:value
@@ -90,38 +147,62 @@ def add_number_cell(row: Row, value: float = None, style: Optional[str] = None,
     Do not add visible text for numeric cells (prevents string casting).
     Pragmatic override: when style is a neutral CASHx_CELL, stamp POS/NEG style directly.
     """
-    def resolve_cash_style(base: str, is_negative: bool) -> str:
-        u = (base or "").strip().upper()
-        if not u.startswith("CASH") or not u.endswith("_CELL"):
-            return base or "CASH0_CELL"
-        if u.endswith("_POS_CELL") or u.endswith("_NEG_CELL"):
-            return u
-        return u.replace("_CELL", "_NEG_CELL" if is_negative else "_POS_CELL")
-
-    cell = Cell()
     is_negative = False
 
     if formula:
-        # Heuristic: detect simple negative formulas
-        f = formula.strip().upper()
-        # negatives like "-A1", "A1*-1", "SUM(...)*-1", "(-A1)", etc.
-        if f.startswith("-"):
-            is_negative = True
-        elif "*-1" in f or "=-" in f:
-            is_negative = True
-        cell.set_attribute("table:formula", f"of:={formula}")
-        cell.set_attribute("office:value-type", "float")
-        cell.set_attribute("office:value", "0")
+        is_negative = _formula_is_negative(formula)
+        value_attrs = f'table:formula="of:={_xml_attr(formula)}" office:value-type="float" office:value="0"'
     else:
         num = float(value or 0.0)
         is_negative = num < 0
-        cell.set_attribute("office:value-type", "float")
-        cell.set_attribute("office:value", str(num))
+        value_attrs = f'office:value-type="float" office:value="{num}"'
 
     # Apply resolved style
-    stamped_style = resolve_cash_style(style or "CASH0_CELL", is_negative)
-    cell.set_attribute("table:style-name", stamped_style)
-    row.append(cell)
+    row.append(f'<table:table-cell {value_attrs} table:style-name="{_cash_style_name(style or "CASH0_CELL", is_negative)}"/>')
+
+def add_marker_cell(row: SheetRow, code: str) -> None:
+    # Column C category marker: a constant string formula ="<code>" with the neutral cash style.
+    # Same cell add_number_cell(formula=f'"{code}"') produced, written from one template
+    row.append(f'<table:table-cell table:formula="of:=&quot;{_xml_attr(code)}&quot;" office:value-type="float" office:value="0" table:style-name="CASH0_POS_CELL"/>')
+
+def add_number_cells(row: SheetRow, values, style: Optional[str] = None) -> None:
+    """
+    Bulk form of add_number_cell(row, value=v, style=style) for a run of plain numbers:
+    the POS/NEG stamped styles are resolved once for the run and the cells are appended in one extend.
+    """
+    base = style or "CASH0_CELL"
+    pos_tail = f'" table:style-name="{_cash_style_name(base, False)}"/>'
+    neg_tail = f'" table:style-name="{_cash_style_name(base, True)}"/>'
+    row.cells.extend(
+        f'<table:table-cell office:value-type="float" office:value="{num}{neg_tail if num < 0 else pos_tail}'
+        for num in (float(v or 0.0) for v in values)
+    )
+
+def add_formula_cells(row: SheetRow, formulas, style: Optional[str] = None) -> None:
+    """
+    Bulk form of add_number_cell(row, formula=f, style=style) for a run of formulas built in one comprehension.
+    """
+    base = style or "CASH0_CELL"
+    pos_tail = f'" office:value-type="float" office:value="0" table:style-name="{_cash_style_name(base, False)}"/>'
+    neg_tail = f'" office:value-type="float" office:value="0" table:style-name="{_cash_style_name(base, True)}"/>'
+    row.cells.extend(
+        f'<table:table-cell table:formula="of:={_xml_attr(f)}{neg_tail if _formula_is_negative(f) else pos_tail}'
+        for f in formulas
+    )
+
+def add_column_sum_cells(row: SheetRow, first_col: int, last_col: int, first_row: int, last_row: int,
+                         style: Optional[str] = None, negate: bool = False) -> None:
+    """
+    One SUM([.Xfirst:.Xlast]) formula cell per column first_col..last_col, as add_number_cell(formula=...) writes it.
+    Only the column letter varies along the row, so the cell is a single f-string per letter.
+    negate appends *-1 (negative polarity), which add_number_cell stamps with the NEG style.
+    """
+    sign = "*-1" if negate else ""
+    tail = f'{last_row}]){sign}" office:value-type="float" office:value="0" table:style-name="{_cash_style_name(style or "CASH0_CELL", negate)}"/>'
+    row.cells.extend(
+        f'<table:table-cell table:formula="of:=SUM([.{letter}{first_row}:.{letter}{tail}'
+        for letter in _COL_LETTERS[first_col:last_col + 1]
+    )
 
 def _to_semantic_cell_style(template_code: Optional[str]) -> str:
     """
@@ -139,6 +220,29 @@ def _to_semantic_cell_style(template_code: Optional[str]) -> str:
         return f"{u}_CELL"
     return "CASH0_CELL"
 
+# settings.xml lookups used by freeze_and_rename_active_sheet, compiled once at import.
+# Names are bound as XPath variables ($name) rather than spliced into the expression text
+_CONFIG_NS = {"config": "urn:oasis:names:tc:opendocument:xmlns:config:1.0"}
+_XP_VIEW_SETS = etree.XPath(".//config:config-item-set[@config:name='ooo:view-settings']", namespaces=_CONFIG_NS)
+_XP_VIEWS = etree.XPath(".//config:config-item-map-indexed[@config:name='Views']", namespaces=_CONFIG_NS)
+_XP_ENTRIES = etree.XPath("./config:config-item-map-entry", namespaces=_CONFIG_NS)
+_XP_GHOST_ENTRIES = etree.XPath("./config:config-item-map-entry[@config:name='Feuille1' or @config:name='Sheet1']",
+                               namespaces=_CONFIG_NS)
+_XP_ENTRY_BY_NAME = etree.XPath("./config:config-item-map-entry[@config:name=$name]", namespaces=_CONFIG_NS)
+_XP_ITEM_BY_NAME = etree.XPath("./config:config-item[@config:name=$name]", namespaces=_CONFIG_NS)
+_XP_TABLES_MAP = etree.XPath("./config:config-item-map-named[@config:name='Tables']", namespaces=_CONFIG_NS)
+_XP_CFG_SETS = etree.XPath(".//config:config-item-set[@config:name='ooo:configuration-settings']", namespaces=_CONFIG_NS)
+_XP_SCRIPT_MAPS = etree.XPath(".//config:config-item-map-named[@config:name='ScriptConfiguration']", namespaces=_CONFIG_NS)
+
+def _xp(query: etree.XPath, node: Element, **variables) -> list[Element]:
+    # Run a precompiled query against an odfdo element and wrap the matches back as odfdo elements
+    return [Element.from_tag(e) for e in query(node._xml_element, **variables)]
+
+def _xp_remove(query: etree.XPath, node: Element, **variables) -> None:
+    # Detach every match straight from its lxml parent; no odfdo wrappers are needed just to delete
+    for e in query(node._xml_element, **variables):
+        e.getparent().remove(e)
+
 def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_index: int = 4):
     settings = getattr(doc, "settings", None)
     if settings is None:
@@ -153,7 +257,7 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
         return e
 
     # 1) Locate the main view-settings set (do not remove it)
-    view_sets = settings.root.xpath(".//config:config-item-set[@config:name='ooo:view-settings']")
+    view_sets = _xp(_XP_VIEW_SETS, settings.root)
     if not view_sets:
         # If absent, create a minimal container
         view_set = Element.from_tag("config:config-item-set")
@@ -163,7 +267,7 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
         view_set = view_sets[0]
 
     # 2) Get or create the first view entry
-    views_list = view_set.xpath(".//config:config-item-map-indexed[@config:name='Views']")
+    views_list = _xp(_XP_VIEWS, view_set)
     if not views_list:
         views = Element.from_tag("config:config-item-map-indexed")
         views.set_attribute("config:name", "Views")
@@ -171,7 +275,7 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
     else:
         views = views_list[0]
 
-    entries = views.xpath("./config:config-item-map-entry")
+    entries = _xp(_XP_ENTRIES, views)
     if entries:
         view_entry = entries[0]
     else:
@@ -179,12 +283,11 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
         views.append(view_entry)
 
     # 3) Ensure ActiveTable points to new_name; remove old one if present
-    for at in view_entry.xpath("./config:config-item[@config:name='ActiveTable']"):
-        at.parent.delete(at)
+    _xp_remove(_XP_ITEM_BY_NAME, view_entry, name="ActiveTable")
     view_entry.append(item("ActiveTable", "string", new_name))
 
     # 4) Find/create Tables map, remove ghost entries, and upsert the Cash Flow freeze keys
-    tables_map_list = view_entry.xpath("./config:config-item-map-named[@config:name='Tables']")
+    tables_map_list = _xp(_XP_TABLES_MAP, view_entry)
     if not tables_map_list:
         tables_map = Element.from_tag("config:config-item-map-named")
         tables_map.set_attribute("config:name", "Tables")
@@ -193,13 +296,10 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
         tables_map = tables_map_list[0]
 
     # Remove ghost table entries like Feuille1/Sheet1
-    for ghost in list(tables_map.xpath("./config:config-item-map-entry")):
-        nm = ghost.get_attribute("config:name") or ""
-        if nm in ("Feuille1", "Sheet1"):
-            tables_map.delete(ghost)
+    _xp_remove(_XP_GHOST_ENTRIES, tables_map)
 
     # Get or create the table entry for new_name
-    target_entries = tables_map.xpath(f"./config:config-item-map-entry[@config:name='{new_name}']")
+    target_entries = _xp(_XP_ENTRY_BY_NAME, tables_map, name=new_name)
     if target_entries:
         table_entry = target_entries[0]
     else:
@@ -208,8 +308,7 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
         tables_map.append(table_entry)
 
     def upsert(ci_name: str, typ: str, val: str):
-        for ci in table_entry.xpath(f"./config:config-item[@config:name='{ci_name}']"):
-            ci.parent.delete(ci)
+        _xp_remove(_XP_ITEM_BY_NAME, table_entry, name=ci_name)
         table_entry.append(item(ci_name, typ, val))
 
     # D5 freeze and pane focus
@@ -226,18 +325,15 @@ def freeze_and_rename_active_sheet(doc: Document, new_name: str, freeze_row_inde
     upsert("PositionBottom", "int", str(freeze_row_index))
 
     # 5) Clean up ScriptConfiguration ghosts (optional but avoids Calc renaming)
-    cfg_sets = settings.root.xpath(".//config:config-item-set[@config:name='ooo:configuration-settings']")
+    cfg_sets = _xp(_XP_CFG_SETS, settings.root)
     if cfg_sets:
         cfg_set = cfg_sets[0]
-        script_maps = cfg_set.xpath(".//config:config-item-map-named[@config:name='ScriptConfiguration']")
+        script_maps = _xp(_XP_SCRIPT_MAPS, cfg_set)
         if script_maps:
             script_map = script_maps[0]
-            for ghost in list(script_map.xpath("./config:config-item-map-entry")):
-                nm = ghost.get_attribute("config:name") or ""
-                if nm in ("Feuille1", "Sheet1"):
-                    script_map.delete(ghost)
+            _xp_remove(_XP_GHOST_ENTRIES, script_map)
             # Upsert CodeName for new_name if needed
-            target = script_map.xpath(f"./config:config-item-map-entry[@config:name='{new_name}']")
+            target = _xp(_XP_ENTRY_BY_NAME, script_map, name=new_name)
             if not target:
                 entry = Element.from_tag("config:config-item-map-entry")
                 entry.set_attribute("config:name", new_name)
@@ -251,16 +347,40 @@ def cols_for_year_block(month_count: int, year_index: int) -> tuple[int, int]:
 
 class SheetBuilder:
     """
-    Tracks rows appended to compute 1-based row indices for formulas.
+    Accumulates the sheet as XML text and tracks rows appended to compute 1-based row indices for formulas.
     """
     def __init__(self, name: str):
-        self.table = Table(name=name)
+        self.name = name
+        self._xml_parts: list[str] = []
         self._row_index = 0
 
-    def append_row(self, row: Row):
-        self.table.append(row)
+    def append_column(self, style: Optional[str] = None, visibility: Optional[str] = None,
+                      default_cell_style: Optional[str] = None) -> None:
+        # Columns must all be appended before the first row
+        attrs = ""
+        if style:
+            attrs += f' table:style-name="{_xml_attr(style)}"'
+        if visibility:
+            attrs += f' table:visibility="{_xml_attr(visibility)}"'
+        if default_cell_style:
+            attrs += f' table:default-cell-style-name="{_xml_attr(default_cell_style)}"'
+        self._xml_parts.append(f"<table:table-column{attrs}/>")
+
+    def append_row(self, row: SheetRow):
+        self._xml_parts.append("<table:table-row>")
+        self._xml_parts.extend(row.cells)
+        self._xml_parts.append("</table:table-row>")
+        self._row_index += 1
+
+    def append_empty_row(self) -> None:
+        # Spacer row: one shared fragment, no SheetRow needed
+        self._xml_parts.append(EMPTY_ROW)
         self._row_index += 1
 
+    def to_xml(self) -> str:
+        # The whole table:table element; prefixes resolve against the content.xml root declarations
+        return f'<table:table table:name="{_xml_attr(self.name)}">{"".join(self._xml_parts)}</table:table>'
+
     def current_row_index(self) -> int:
         return self._row_index
 
@@ -275,10 +395,10 @@ def render_summary_after_categories(sb: SheetBuilder,
         return
 
     # Header
-    hdr = Row()
+    hdr = SheetRow()
     add_text_cell(hdr, res.t("TextSummary"))
     add_text_cell(hdr, "")
-    hdr.append(Cell())  # C
+    add_empty_cell(hdr)  # C
     sb.append_row(hdr)
 
     firstCol = 4
@@ -292,33 +412,29 @@ def render_summary_after_categories(sb: SheetBuilder,
         code = (cat.get("CategoryCode") or "").strip()
         name = cat.get("Category", "") or ""
 
-        r = Row()
+        r = SheetRow()
         add_text_cell(r, code)   # A
         add_text_cell(r, name)   # B
-        r.append(Cell())  # C reserved
+        add_empty_cell(r)  # C reserved
 
         target_row = (totals_row_by_category or {}).get(code, -1)
 
-        for col in range(firstCol, lastCol + 1):
-            col_letter = _col_letter(col)
-            if target_row > 0:
-                # Use default numeric style so Style Factory formats are applied
-                add_number_cell(r, formula=f"{col_letter}{target_row}", style="CASH0_CELL")
-            else:
-                add_number_cell(r, value=0.0, style="CASH0_CELL")
+        if target_row > 0:
+            # Use default numeric style so Style Factory formats are applied
+            add_formula_cells(r, [f"{letter}{target_row}" for letter in _COL_LETTERS[firstCol:lastCol + 1]], style="CASH0_CELL")
+        else:
+            add_number_cells(r, [0.0] * (lastCol - firstCol + 1), style="CASH0_CELL")
 
         sb.append_row(r)
 
     # Period Total row: SUM of the summary rows per column
-    pr = Row()
+    pr = SheetRow()
     add_text_cell(pr, res.t("TextPeriodTotal"))
     add_text_cell(pr, "")
-    pr.append(Cell())
+    add_empty_cell(pr)
     end_row_index = sb.current_row_index()
 
-    for col in range(firstCol, lastCol + 1):
-        col_letter = _col_letter(col)
-        add_number_cell(pr, formula=f"SUM([.{col_letter}{start_row_index}:.{col_letter}{end_row_index}])", style="CASH0_CELL")
+    add_column_sum_cells(pr, firstCol, lastCol, start_row_index, end_row_index, style="CASH0_CELL")
 
     sb.append_row(pr)
 
@@ -331,105 +447,112 @@ def render_categories_and_summary(sb: SheetBuilder,
                                   include_active: bool,
                                   include_orderbook: bool,
                                   include_tax_accruals: bool,
-                                  totals_row_by_category: Optional[dict[str, int]] = None):
-    sb.append_row(Row())
-    categories = repo.get_categories(cash_type)
-
+                                  totals_row_by_category: Optional[dict[str, int]] = None,
+                                  categories: Optional[list] = None):
+    sb.append_empty_row()
+    # Whole category/code/value tree for this cash type in a handful of round trips (unless already loaded)
+    year_numbers = [int(y.get("YearNumber")) for y in years]
+    month_numbers = [int(m.get("MonthNumber")) for m in months]
+    if categories is None:
+        categories = repo.get_category_slice(cash_type, year_numbers,
+                                             include_active, include_orderbook, include_tax_accruals)
+
+    # Layout pass: each category is a name row, one row per cash code, a totals row and a spacer, so every
+    # row index the formulas reference is known up front instead of being read back while emitting
+    layout = []
+    next_row = sb.current_row_index() + 1
     for cat in categories:
+        codes = cat.get("CashCodes", [])
+        first_code_row = next_row + 1
+        totals_row = first_code_row + len(codes)
+        cat_code = (cat.get("CategoryCode","") or "").strip()
+        layout.append((cat, cat_code, codes, first_code_row, totals_row))
+        if totals_row_by_category is not None and cat_code:
+            totals_row_by_category[cat_code] = totals_row
+        next_row = totals_row + 2
+
+    total_cols = len(years) * (len(months) + 1)
+    totals_label = res.t("TextTotals")
+    # Per-year month span (first/last month column letters) for the year total formula; only depends on
+    # the year position, so resolve it once rather than per code row
+    year_spans = []
+    for y_idx, year_number in enumerate(year_numbers):
+        start_col = 4 + (y_idx * (len(months) + 1))
+        year_spans.append((year_number, _COL_LETTERS[start_col], _COL_LETTERS[start_col + len(months) - 1]))
+
+    for cat, cat_code, codes, first_code_row, totals_row in layout:
         # Category name row
-        cat_row = Row()
+        cat_row = SheetRow()
         add_text_cell(cat_row, cat.get("Category",""))
         add_text_cell(cat_row, "")
-        cat_row.append(Cell())
+        add_empty_cell(cat_row)
         sb.append_row(cat_row)
 
-        codes = repo.get_cash_codes(cat.get("CategoryCode",""))
-
-        for code in codes:
-            r = Row()
+        for code_row, code in enumerate(codes, start=first_code_row):
+            r = SheetRow()
             add_text_cell(r, code.get("CashCode",""))
             add_text_cell(r, code.get("CashDescription",""))
-            r.append(Cell())
-            # Correct current row index for formulas (avoid drift)
-            cur_row_index = sb.current_row_index() + 1
-
-            for y_idx, y in enumerate(years):
-                year_num = int(y.get("YearNumber"))
-                vals = repo.get_cash_code_values(code.get("CashCode",""),
-                                                 year_num,
-                                                 include_active, include_orderbook, include_tax_accruals)
-                mm = { int(v.get("MonthNumber")): float(v.get("InvoiceValue", 0) or 0) for v in vals }
+            add_empty_cell(r)
+
+            values_by_year = code["Values"]
+            for year_number, start_letter, end_letter in year_spans:
+                vals = values_by_year.get(year_number, [])
+                # Repository rows arrive projected: int MonthNumber, float InvoiceValue (nulls coalesced to 0.0);
+                # slot them by month number (1..12) into a preallocated list
+                mm = [0.0] * 13
+                for v in vals:
+                    if v["MonthNumber"] is not None:
+                        mm[v["MonthNumber"]] = v["InvoiceValue"]
 
                 # Month cells
-                for m in months:
-                    v = mm.get(int(m.get("MonthNumber")), 0.0)
-                    add_number_cell(r, value=v)
+                add_number_cells(r, [mm[mn] for mn in month_numbers])
 
                 # Year total formula: SUM of that year's months
-                start_col = 4 + (y_idx * (len(months) + 1))
-                end_col = start_col + len(months) - 1
-                start_letter = _col_letter(start_col)
-                end_letter = _col_letter(end_col)
-                add_number_cell(r, formula=f"SUM([.{start_letter}{cur_row_index}:.{end_letter}{cur_row_index}])")
+                add_number_cell(r, formula=f"SUM([.{start_letter}{code_row}:.{end_letter}{code_row}])")
 
             sb.append_row(r)
 
         # Category totals row: SUM down each period column, apply polarity like Excel
-        tot = Row()
-        add_text_cell(tot, res.t("TextTotals"))
+        tot = SheetRow()
+        add_text_cell(tot, totals_label)
         add_text_cell(tot, "")
         # Column C marker (not relied upon programmatically)
-        cat_code = (cat.get("CategoryCode","") or "").strip()
-        add_number_cell(tot, formula=f"\"{cat_code}\"", display_text="")
-        # Correct index for totals row
-        cur_row_index = sb.current_row_index() + 1
+        add_marker_cell(tot, cat_code)
 
         # Determine polarity factor: 0 => multiply by -1, 1 or others => as-is
         cash_polarity = cat.get("CashPolarityCode")
         factor = -1 if cash_polarity == 0 or cash_polarity == "0" else 1
 
-        total_cols = len(years) * (len(months) + 1)
-        for i in range(total_cols):
-            col = 4 + i
-            col_letter = _col_letter(col)
-            # Sum the block of cash code rows just appended
-            # We can compute the number of codes per category from 'codes'
-            first_code_row = cur_row_index - len(codes)
-            last_code_row = cur_row_index - 1
-            base_sum = f"SUM([.{col_letter}{first_code_row}:.{col_letter}{last_code_row}])"
-            if factor == -1:
-                add_number_cell(tot, formula=f"{base_sum}*-1")
-            else:
-                add_number_cell(tot, formula=base_sum)
+        # Sum the block of cash code rows laid out for this category
+        last_code_row = totals_row - 1
+        add_column_sum_cells(tot, 4, 3 + total_cols, first_code_row, last_code_row, negate=(factor == -1))
 
         sb.append_row(tot)
-        sb.append_row(Row())
-        if totals_row_by_category is not None and cat_code:
-            totals_row_by_category[cat_code] = cur_row_index
+        sb.append_empty_row()
 
 def render_summary_totals_block(sb: SheetBuilder, repo, res: ResourceManager,
                                 cash_type: Union[CashType, int],
                                 totals_row_by_category: Optional[dict[str, int]] = None):
-    totals = repo.get_categories_by_type(cash_type, "Total") if hasattr(repo, "get_categories_by_type") else []
+    totals = repo.get_categories_by_type(cash_type, "Total") if "get_categories_by_type" in repo_capabilities(repo) else []
     if not totals or len(totals) < 2:
         return
-    sb.append_row(Row())
+    sb.append_empty_row()
 
-    hdr = Row()
+    hdr = SheetRow()
     heading = f"{totals[0].get('CashType','')} {res.t('TextTotals')}".strip()
     add_text_cell(hdr, heading)
     add_text_cell(hdr, "")
-    hdr.append(Cell())
+    add_empty_cell(hdr)
     sb.append_row(hdr)
 
     for t in totals:
-        r = Row()
+        r = SheetRow()
         code = (t.get("CategoryCode", "") or "").strip()
         desc = t.get("Category", "") or ""
         add_text_cell(r, code)                 # A
         add_text_cell(r, desc)                 # B
         # C: marker equals code for lookup
-        add_number_cell(r, formula=f"\"{code}\"", display_text="")
+        add_marker_cell(r, code)
         # record row index if requested
         if totals_row_by_category is not None and code:
             row_index = sb.current_row_index() + 1
@@ -440,14 +563,15 @@ def render_summary_totals_block(sb: SheetBuilder, repo, res: ResourceManager,
 
 def render_totals_formula(sb: SheetBuilder, repo, res: ResourceManager, years=None, months=None,
                           totals_row_by_category: Optional[dict[str, int]] = None):
-    sb.append_row(Row())
-    hdr = Row()
+    sb.append_empty_row()
+    hdr = SheetRow()
     add_text_cell(hdr, res.t("TextTotals"))
     add_text_cell(hdr, "")
-    hdr.append(Cell())
+    add_empty_cell(hdr)
     sb.append_row(hdr)
 
-    if not hasattr(repo, "get_category_totals") or not hasattr(repo, "get_category_total_codes"):
+    caps = repo_capabilities(repo)
+    if "get_category_totals" not in caps or "get_category_total_codes" not in caps:
         return
 
     totals = repo.get_category_totals() or []
@@ -467,10 +591,10 @@ def render_totals_formula(sb: SheetBuilder, repo, res: ResourceManager, years=No
         if not code:
             continue
 
-        r = Row()
+        r = SheetRow()
         add_text_cell(r, code)         # A: CategoryCode
         add_text_cell(r, desc)         # B: Category
-        add_number_cell(r, formula=f"\"{code}\"", display_text="")  # C marker
+        add_marker_cell(r, code)  # C marker
 
         # Register row for expressions block
         row_index = sb.current_row_index() + 1
@@ -480,18 +604,19 @@ def render_totals_formula(sb: SheetBuilder, repo, res: ResourceManager, years=No
         sum_codes_rows = repo.get_category_total_codes(code) or []
         src_codes = [row.get("SourceCategoryCode", row.get("CategoryCode", "")) for row in sum_codes_rows if row]
 
-        for col in range(first_col, last_col + 1):
-            col_letter = _col_letter(col)
-            terms = []
+        # Rows of the source totals are the same in every column; resolve them once per total
+        src_rows = []
+        if totals_row_by_category:
             for sc in src_codes:
                 sc = (sc or "").strip()
-                if totals_row_by_category and sc in totals_row_by_category:
-                    terms.append(f"{col_letter}{totals_row_by_category[sc]}")
+                if sc in totals_row_by_category:
+                    src_rows.append(totals_row_by_category[sc])
 
-            if terms:
-                add_number_cell(r, formula="+".join(terms))
-            else:
-                add_number_cell(r, value=0.0)
+        if src_rows:
+            add_formula_cells(r, ["+".join([f"{letter}{row_num}" for row_num in src_rows])
+                                  for letter in _COL_LETTERS[first_col:last_col + 1]])
+        else:
+            add_number_cells(r, [0.0] * (last_col - first_col + 1))
 
         sb.append_row(r)
 
@@ -508,13 +633,14 @@ def render_expressions(sb: SheetBuilder,
     - C: CategoryCode marker (if resolvable)
     - D..: formulas referencing totals rows in the same column.
     """
-    hdr = Row()
+    hdr = SheetRow()
     add_text_cell(hdr, res.t("TextAnalysis"))
     add_text_cell(hdr, "")
-    hdr.append(Cell())
+    add_empty_cell(hdr)
     sb.append_row(hdr)
 
-    if not hasattr(repo, "get_category_expressions"):
+    caps = repo_capabilities(repo)
+    if "get_category_expressions" not in caps:
         return
 
     exprs = repo.get_category_expressions() or []
@@ -523,7 +649,7 @@ def render_expressions(sb: SheetBuilder,
 
     # Build description->code map for totals (e.g. "Gross Profit"->"001")
     totals_by_name = {}
-    if hasattr(repo, "get_category_totals"):
+    if "get_category_totals" in caps:
         for t in repo.get_category_totals() or []:
             nm = (t.get("Category") or "").strip()
             cd = (t.get("CategoryCode") or "").strip()
@@ -537,13 +663,22 @@ def render_expressions(sb: SheetBuilder,
     if last_col < first_col:
         return
 
-    import re
     def normalize_for_calc(formula_text: str) -> str:
-        f = re.sub(r'\bif\s*\(', 'IF(', formula_text, flags=re.IGNORECASE)
-        return f.replace(',', ';')
+        return _IF_RE.sub('IF(', formula_text).replace(',', ';')
+
+    # Category name -> code, resolved once per export; expressions keep referencing the same totals
+    has_name_lookup = "get_category_code_from_name" in caps
+    code_by_name: dict[str, str] = {}
+
+    def code_from_name(name: str) -> str:
+        code = code_by_name.get(name)
+        if code is None:
+            code = (repo.get_category_code_from_name(name) or "").strip() if has_name_lookup else ""
+            code_by_name[name] = code
+        return code
 
     for expr in exprs:
-        r = Row()
+        r = SheetRow()
         category_name = (expr.get("Category") or "").strip()
         template = (expr.get("Expression") or "").strip()
 
@@ -557,67 +692,63 @@ def render_expressions(sb: SheetBuilder,
 
         # Column C: expression CategoryCode marker
         expr_code = (expr.get("CategoryCode") or "").strip()
-        if not expr_code and hasattr(repo, "get_category_code_from_name"):
-            expr_code = (repo.get_category_code_from_name(category_name) or "").strip()
+        if not expr_code:
+            expr_code = code_from_name(category_name)
         if not expr_code:
             expr_code = totals_by_name.get(category_name, "")
         if expr_code:
-            add_number_cell(r, formula=f"\"{expr_code}\"", display_text="")
+            add_marker_cell(r, expr_code)
         else:
-            r.append(Cell())
-
-        # Extract [Name] tokens
-        tokens: list[str] = []
-        i = 0
-        while i < len(template):
-            lb = template.find("[", i)
-            if lb < 0: break
-            rb = template.find("]", lb + 1)
-            if rb < 0: break
-            token = template[lb + 1:rb].strip()
-            if token and token not in tokens:
-                tokens.append(token)
-            i = rb + 1
+            add_empty_cell(r)
+
+        # Extract [Name] tokens (unique, in order of first appearance)
+        tokens = list(dict.fromkeys(t for t in (m.strip() for m in _TOKEN_RE.findall(template)) if t))
 
         # Map names -> codes
-        totals_by_name_local = totals_by_name
         name_to_code: dict[str, str] = {}
         for name in tokens:
-            code = ""
-            if hasattr(repo, "get_category_code_from_name"):
-                code = (repo.get_category_code_from_name(name) or "").strip()
+            code = code_from_name(name)
             if not code:
-                code = totals_by_name_local.get(name, "")
+                code = totals_by_name.get(name, "")
             if not code:
                 code = name
             name_to_code[name] = code
 
-        # Replace [Name] -> [Code] and normalize for Calc
-        normalized = template
-        for name in tokens:
-            normalized = normalized.replace(f"[{name}]", f"[{name_to_code[name]}]")
+        # Replace [Name] -> [Code] in one pass and normalize for Calc
+        normalized = _TOKEN_RE.sub(lambda m: f"[{name_to_code.get(m.group(1).strip(), m.group(1))}]", template)
         normalized = normalize_for_calc(normalized)
 
+        # Split the formula once around its [Code] references; each column then only joins the pieces
+        # with its own cell references ("0" where the code has no totals row)
+        row_by_ref = {f"[{code}]": (totals_row_by_category or {}).get(code, -1) for code in name_to_code.values()}
+        if row_by_ref:
+            ref_re = re.compile("|".join(re.escape(ref) for ref in sorted(row_by_ref, key=len, reverse=True)))
+            pieces = ref_re.split(normalized)
+            ref_rows = [row_by_ref[ref] for ref in ref_re.findall(normalized)]
+        else:
+            pieces, ref_rows = [normalized], []
+
         # Write per-column formulas with style override (Pct0 -> PCT0_CELL, Num2 -> NUM2_CELL, etc.)
-        for col in range(first_col, last_col + 1):
-            col_letter = _col_letter(col)
-            formula = normalized
-            for code in {c for c in name_to_code.values()}:
-                row_index = (totals_row_by_category or {}).get(code, -1)
-                if row_index <= 0:
-                    formula = formula.replace(f"[{code}]", "0")
-                else:
-                    formula = formula.replace(f"[{code}]", f"{col_letter}{row_index}")
-            add_number_cell(r, formula=formula, style=override_style)
+        formulas = []
+        for col_letter in _COL_LETTERS[first_col:last_col + 1]:
+            parts = [pieces[0]]
+            for row_index, piece in zip(ref_rows, pieces[1:]):
+                parts.append(f"{col_letter}{row_index}" if row_index > 0 else "0")
+                parts.append(piece)
+            formulas.append("".join(parts))
+        add_formula_cells(r, formulas, style=override_style)
 
         sb.append_row(r)
 
+# VAT columns that tax accruals are added to (the net sales/purchase rows and the adjustment are left as reported)
+_VAT_ACCRUAL_FIELDS = frozenset(("HomeSalesVat", "HomePurchasesVat", "ExportSalesVat", "ExportPurchasesVat", "VatDue"))
+
 def render_vat_recurrence_totals(sb: SheetBuilder, repo, res, years, months, include_active_periods, include_tax_accruals):
-    hdr = Row()
+    hdr = SheetRow()
     vat_type = (repo.get_vat_recurrence_type() or "").upper()
     add_text_cell(hdr, f"{res.t('TextVatDueTitle')} {vat_type}".upper())
     add_text_cell(hdr, "")
-    hdr.append(Cell())
+    add_empty_cell(hdr)
     sb.append_row(hdr)
 
     labels = [
@@ -633,6 +764,12 @@ def render_vat_recurrence_totals(sb: SheetBuilder, repo, res, years, months, inc
         res.t("TextVatDue")
     ]
 
+    # Source column for each label row above; accruals only top up the VAT amount rows
+    fields = ("HomeSales", "HomePurchases", "ExportSales", "ExportPurchases",
+              "HomeSalesVat", "HomePurchasesVat", "ExportSalesVat", "ExportPurchasesVat",
+              "VatAdjustment", "VatDue")
+    accrual_columns = [(li, field) for li, field in enumerate(fields) if field in _VAT_ACCRUAL_FIELDS]
+
     recurrence = repo.get_vat_recurrence()
     by_year = {}
     for p in recurrence:
@@ -645,61 +782,53 @@ def render_vat_recurrence_totals(sb: SheetBuilder, repo, res, years, months, inc
             y = int(a.get("YearNumber"))
             accruals_by_year.setdefault(y, []).append(a)
 
+    # Periods starting after now are left at zero unless active periods are included; one clock read per render
+    now = None if include_active_periods else datetime.now(timezone.utc)
+
+    # One pass over each year's periods fills every label column: values_by_year[ynum][li] -> per-period values
+    values_by_year = {}
+    for y in years:
+        ynum = int(y.get("YearNumber"))
+        periods = by_year.get(ynum, [])
+        columns = [[0.0] * len(periods) for _ in fields]
+        for idx, p in enumerate(periods):
+            if now is not None:
+                start_on = p.get("StartOn")
+                if isinstance(start_on, datetime) and start_on.tzinfo is None:
+                    start_on = start_on.replace(tzinfo=timezone.utc)
+                if not start_on <= now:
+                    continue
+            for li, field in enumerate(fields):
+                columns[li][idx] = float(p.get(field, 0) or 0)
+
+        if include_tax_accruals:
+            for idx, a in enumerate(accruals_by_year.get(ynum, [])[:len(periods)]):
+                for li, field in accrual_columns:
+                    v = a.get(field)
+                    if v is not None:
+                        columns[li][idx] += float(v)
+        values_by_year[ynum] = columns
+
     for li, label in enumerate(labels):
-        r = Row()
+        r = SheetRow()
         add_text_cell(r, label.upper())
         add_text_cell(r, "")
-        r.append(Cell())
+        add_empty_cell(r)
 
         for y in years:
-            ynum = int(y.get("YearNumber"))
-            periods = by_year.get(ynum, [])
-
-            period_vals = []
-            for p in periods:
-                v = 0.0
-                start_on = p.get("StartOn")
-                if isinstance(start_on, datetime) and start_on.tzinfo is None:
-                    start_on = start_on.replace(tzinfo=timezone.utc)
-                if include_active_periods or (start_on <= datetime.now(timezone.utc)):
-                    if li == 0: v = float(p.get("HomeSales", 0) or 0)
-                    elif li == 1: v = float(p.get("HomePurchases", 0) or 0)
-                    elif li == 2: v = float(p.get("ExportSales", 0) or 0)
-                    elif li == 3: v = float(p.get("ExportPurchases", 0) or 0)
-                    elif li == 4: v = float(p.get("HomeSalesVat", 0) or 0)
-                    elif li == 5: v = float(p.get("HomePurchasesVat", 0) or 0)
-                    elif li == 6: v = float(p.get("ExportSalesVat", 0) or 0)
-                    elif li == 7: v = float(p.get("ExportPurchasesVat", 0) or 0)
-                    elif li == 8: v = float(p.get("VatAdjustment", 0) or 0)
-                    elif li == 9: v = float(p.get("VatDue", 0) or 0)
-                period_vals.append(v)
-
-            if include_tax_accruals and li in (4, 5, 6, 7, 9):
-                accs = accruals_by_year.get(ynum, [])
-                for idx, a in enumerate(accs):
-                    if idx >= len(period_vals):
-                        break
-                    add_val = 0.0
-                    if li == 4 and a.get("HomeSalesVat") is not None: add_val = float(a.get("HomeSalesVat"))
-                    elif li == 5 and a.get("HomePurchasesVat") is not None: add_val = float(a.get("HomePurchasesVat"))
-                    elif li == 6 and a.get("ExportSalesVat") is not None: add_val = float(a.get("ExportSalesVat"))
-                    elif li == 7 and a.get("ExportPurchasesVat") is not None: add_val = float(a.get("ExportPurchasesVat"))
-                    elif li == 9 and a.get("VatDue") is not None: add_val = float(a.get("VatDue"))
-                    period_vals[idx] += add_val
-
-            for v in period_vals:
-                add_number_cell(r, v)
+            period_vals = values_by_year[int(y.get("YearNumber"))][li]
+            add_number_cells(r, period_vals)
             add_number_cell(r, sum(period_vals))
 
         sb.append_row(r)
 
-    sb.append_row(Row())  # spacer
+    sb.append_empty_row()  # spacer
 
 def render_vat_period_totals(sb: SheetBuilder, repo, res, years, months, include_active_periods, include_tax_accruals):
-    hdr = Row()
+    hdr = SheetRow()
     add_text_cell(hdr, f"{res.t('TextVatDueTitle')} {res.t('TextTotals')}".upper())
     add_text_cell(hdr, "")
-    hdr.append(Cell())
+    add_empty_cell(hdr)
     sb.append_row(hdr)
 
     labels = [
@@ -714,6 +843,12 @@ def render_vat_period_totals(sb: SheetBuilder, repo, res, years, months, include
         res.t("TextVatDue")
     ]
 
+    # Source column for each label row above; accruals only top up the VAT amount rows
+    fields = ("HomeSales", "HomePurchases", "ExportSales", "ExportPurchases",
+              "HomeSalesVat", "HomePurchasesVat", "ExportSalesVat", "ExportPurchasesVat",
+              "VatDue")
+    accrual_columns = [(li, field) for li, field in enumerate(fields) if field in _VAT_ACCRUAL_FIELDS]
+
     monthly = repo.get_vat_period_totals()
     by_year = {}
     for p in monthly:
@@ -726,76 +861,74 @@ def render_vat_period_totals(sb: SheetBuilder, repo, res, years, months, include
             y = int(a.get("YearNumber"))
             accruals_by_year.setdefault(y, []).append(a)
 
-    for li, label in enumerate(labels):
-        r = Row()
-        add_text_cell(r, label.upper() if li == len(labels) - 1 else label.upper())
-        add_text_cell(r, "")
-        r.append(Cell())
+    # Periods starting after now are left out unless active periods are included; one clock read per render
+    now = None if include_active_periods else datetime.now(timezone.utc)
 
-        for y in years:
-            ynum = int(y.get("YearNumber"))
-            periods = by_year.get(ynum, [])
-            month_vals = [0.0] * len(months)
+    # Calendar month -> column position in the financial year (first occurrence wins)
+    month_index = {}
+    for i, m in enumerate(months):
+        month_index.setdefault(int(m.get("MonthNumber")), i)
 
-            for p in periods:
+    # One pass over each year's periods fills every label column: values_by_year[ynum][li] -> per-month values
+    values_by_year = {}
+    for y in years:
+        ynum = int(y.get("YearNumber"))
+        periods = by_year.get(ynum, [])
+        columns = [[0.0] * len(months) for _ in fields]
+        for p in periods:
+            if now is not None:
                 start_on = p.get("StartOn")
                 if isinstance(start_on, datetime) and start_on.tzinfo is None:
                     start_on = start_on.replace(tzinfo=timezone.utc)
-                if include_active_periods or (start_on <= datetime.now(timezone.utc)):
-                    mdt = p.get("StartOn")
-                    mnum = mdt.month if hasattr(mdt, "month") else None
-                    if mnum is None:
-                        continue
-                    idx = next((i for i, m in enumerate(months) if int(m.get("MonthNumber")) == mnum), None)
-                    if idx is None:
-                        continue
-                    v = 0.0
-                    if li == 0: v = float(p.get("HomeSales", 0) or 0)
-                    elif li == 1: v = float(p.get("HomePurchases", 0) or 0)
-                    elif li == 2: v = float(p.get("ExportSales", 0) or 0)
-                    elif li == 3: v = float(p.get("ExportPurchases", 0) or 0)
-                    elif li == 4: v = float(p.get("HomeSalesVat", 0) or 0)
-                    elif li == 5: v = float(p.get("HomePurchasesVat", 0) or 0)
-                    elif li == 6: v = float(p.get("ExportSalesVat", 0) or 0)
-                    elif li == 7: v = float(p.get("ExportPurchasesVat", 0) or 0)
-                    elif li == 8: v = float(p.get("VatDue", 0) or 0)
-                    month_vals[idx] += v
-
-            if include_tax_accruals and li in (4, 5, 6, 7, 8):
-                accs = accruals_by_year.get(ynum, [])
-                for idx, a in enumerate(accs):
-                    if idx >= len(month_vals):
-                        break
-                    add_val = 0.0
-                    if li == 4 and a.get("HomeSalesVat") is not None: add_val = float(a.get("HomeSalesVat"))
-                    elif li == 5 and a.get("HomePurchasesVat") is not None: add_val = float(a.get("HomePurchasesVat"))
-                    elif li == 6 and a.get("ExportSalesVat") is not None: add_val = float(a.get("ExportSalesVat"))
-                    elif li == 7 and a.get("ExportPurchasesVat") is not None: add_val = float(a.get("ExportPurchasesVat"))
-                    elif li == 8 and a.get("VatDue") is not None: add_val = float(a.get("VatDue"))
-                    month_vals[idx] += add_val
-
-            for v in month_vals:
-                add_number_cell(r, v)
+                if not start_on <= now:
+                    continue
+            mdt = p.get("StartOn")
+            mnum = mdt.month if hasattr(mdt, "month") else None
+            if mnum is None:
+                continue
+            idx = month_index.get(mnum)
+            if idx is None:
+                continue
+            for li, field in enumerate(fields):
+                columns[li][idx] += float(p.get(field, 0) or 0)
+
+        if include_tax_accruals:
+            for idx, a in enumerate(accruals_by_year.get(ynum, [])[:len(months)]):
+                for li, field in accrual_columns:
+                    v = a.get(field)
+                    if v is not None:
+                        columns[li][idx] += float(v)
+        values_by_year[ynum] = columns
+
+    for li, label in enumerate(labels):
+        r = SheetRow()
+        add_text_cell(r, label.upper())
+        add_text_cell(r, "")
+        add_empty_cell(r)
+
+        for y in years:
+            month_vals = values_by_year[int(y.get("YearNumber"))][li]
+            add_number_cells(r, month_vals)
             add_number_cell(r, sum(month_vals))
 
         sb.append_row(r)
 
-    sb.append_row(Row())  # spacer
+    sb.append_empty_row()  # spacer
 
 def render_bank_balances(sb: SheetBuilder, repo, res, years, months):
-    sb.append_row(Row())
-    hr = Row()
+    sb.append_empty_row()
+    hr = SheetRow()
     add_text_cell(hr, res.t("TextClosingBalances").upper())
     add_text_cell(hr, "")
-    hr.append(Cell())
+    add_empty_cell(hr)
     sb.append_row(hr)
 
     accounts = repo.get_bank_accounts()
     if not accounts:
-        r = Row()
+        r = SheetRow()
         add_text_cell(r, "(no bank accounts)")
         add_text_cell(r, "")
-        r.append(Cell())
+        add_empty_cell(r)
         sb.append_row(r)
         return
 
@@ -803,73 +936,99 @@ def render_bank_balances(sb: SheetBuilder, repo, res, years, months):
     total_cols = len(years) * cols_per_year
     company_totals = [0.0] * total_cols
 
+    # Period keys read out of the row dicts once, not per cell
+    year_numbers = [int(y.get("YearNumber")) for y in years]
+    month_numbers = [int(m.get("MonthNumber")) for m in months]
+    no_balances = [None] * 13
+
+    # All accounts' balances in one query when the repository supports it
+    all_balances = repo.get_all_bank_balances() if "get_all_bank_balances" in repo_capabilities(repo) else None
+
     for acct in accounts:
-        r = Row()
+        r = SheetRow()
         add_text_cell(r, acct.get("AccountCode", ""))
         add_text_cell(r, acct.get("AccountName", ""))
-        r.append(Cell())
+        add_empty_cell(r)
 
-        balances = repo.get_bank_balances(acct.get("AccountCode", ""))
-        bal_map = {(int(b["YearNumber"]), int(b["MonthNumber"])): float(b["Balance"] or 0) for b in balances}
-
-        for y_idx, y in enumerate(years):
-            year_num = int(y.get("YearNumber"))
+        if all_balances is not None:
+            balances = all_balances.get(acct.get("AccountCode", ""), [])
+        else:
+            balances = repo.get_bank_balances(acct.get("AccountCode", ""))
+        # Month slots (1..12) per year; None marks a month with no balance row
+        bal_by_year = {}
+        for b in balances:
+            bal_by_year.setdefault(int(b["YearNumber"]), [None] * 13)[int(b["MonthNumber"])] = float(b["Balance"] or 0)
+
+        for y_idx, year_num in enumerate(year_numbers):
+            bal = bal_by_year.get(year_num, no_balances)
             last_val = None
-            for m_idx, m in enumerate(months):
-                v = bal_map.get((year_num, int(m.get("MonthNumber"))), 0.0)
+            for m_idx, month_num in enumerate(month_numbers):
+                v = bal[month_num]
+                if v is None:
+                    v = 0.0
                 add_number_cell(r, v)
                 company_totals[y_idx * cols_per_year + m_idx] += v
                 last_val = v
-            carry = bal_map.get((year_num, 12), last_val if last_val is not None else 0.0)
+            carry = bal[12] if bal[12] is not None else (last_val if last_val is not None else 0.0)
             add_number_cell(r, carry)
             company_totals[y_idx * cols_per_year + len(months)] += carry
 
         sb.append_row(r)
 
-    tr = Row()
+    tr = SheetRow()
     add_text_cell(tr, res.t("TextCompanyBalance").upper())
     add_text_cell(tr, "")
-    tr.append(Cell())
-    for val in company_totals:
-        add_number_cell(tr, val)
+    add_empty_cell(tr)
+    add_number_cells(tr, company_totals)
     sb.append_row(tr)
 
 def render_balance_sheet(sb: SheetBuilder, repo, res, years, months):
-    hr = Row()
+    hr = SheetRow()
     add_text_cell(hr, res.t("TextBalanceSheet").upper())
     sb.append_row(hr)
-    entries = repo.get_balance_sheet()
+    # Typed tuples when the repository offers them, otherwise project the dict rows
+    if "get_balance_sheet_rows" in repo_capabilities(repo):
+        entries = repo.get_balance_sheet_rows()
+    else:
+        entries = [(e['AssetCode'], e['AssetName'], int(e['YearNumber']), int(e['MonthNumber']), float(e['Balance'] or 0))
+                   for e in repo.get_balance_sheet()]
     if not entries: return
 
-    order = []
-    groups = {}
-    for e in entries:
-        key = f"{e['AssetCode']}\u001F{e['AssetName']}"
-        if key not in groups:
-            groups[key] = {}
-            order.append((e['AssetCode'], e['AssetName'], key))
-        groups[key][(int(e['YearNumber']), int(e['MonthNumber']))] = float(e['Balance'] or 0)
-
-    for code, name, key in order:
-        r = Row()
+    # Period keys read out of the row dicts once, not per cell
+    year_numbers = [int(y.get("YearNumber")) for y in years]
+    month_numbers = [int(m.get("MonthNumber")) for m in months]
+
+    # (code, name) -> year -> month slots (1..12), in first-seen order; None marks a month with no entry
+    groups: dict[tuple[str, str], dict[int, list]] = {}
+    no_balances = [None] * 13
+    for asset_code, asset_name, year_num, month_num, balance in entries:
+        by_year = groups.get((asset_code, asset_name))
+        if by_year is None:
+            by_year = groups[(asset_code, asset_name)] = {}
+        slots = by_year.get(year_num)
+        if slots is None:
+            slots = by_year[year_num] = [None] * 13
+        slots[month_num] = balance
+
+    for (code, name), by_year in groups.items():
+        r = SheetRow()
         add_text_cell(r, code)      # A
         add_text_cell(r, name)      # B
-        r.append(Cell())            # C reserved so months start at D
+        add_empty_cell(r)            # C reserved so months start at D
 
         cur_row_index = sb.current_row_index() + 1
 
-        for y_idx, y in enumerate(years):
-            year_num = int(y.get("YearNumber"))
+        for y_idx, year_num in enumerate(year_numbers):
             year_start_col = 4 + (y_idx * (len(months) + 1))  # D is 4
             last_non_empty_col_letter = None
+            slots = by_year.get(year_num, no_balances)
 
             # months
-            for m_idx, m in enumerate(months):
-                mm = int(m.get("MonthNumber"))
-                v = groups[key].get((year_num, mm))
+            for m_idx, month_num in enumerate(month_numbers):
+                v = slots[month_num]
                 add_number_cell(r, value=(v or 0.0))
                 if v is not None:
-                    last_non_empty_col_letter = _col_letter(year_start_col + m_idx)
+                    last_non_empty_col_letter = _COL_LETTERS[year_start_col + m_idx]
 
             # year total: reference last non-empty month cell if any, else 0
             if last_non_empty_col_letter:
@@ -879,20 +1038,18 @@ def render_balance_sheet(sb: SheetBuilder, repo, res, years, months):
 
         sb.append_row(r)
 
-    cap = Row()
+    cap = SheetRow()
     add_text_cell(cap, res.t("TextCapital").upper())
     add_text_cell(cap, "")
-    cap.append(Cell())  # C reserved so totals begin at D
+    add_empty_cell(cap)  # C reserved so totals begin at D
 
     # Capital per column: SUM of asset rows in this section
-    first_asset_row = sb.current_row_index() - len(order) + 1
+    first_asset_row = sb.current_row_index() - len(groups) + 1
     last_row_index = sb.current_row_index() + 1
-    for col_offset in range(len(years) * (len(months) + 1)):
-        col = 4 + col_offset
-        letter = _col_letter(col)
-        add_number_cell(cap, formula=f"SUM([.{letter}{first_asset_row}:.{letter}{last_row_index - 1}])")
+    add_column_sum_cells(cap, 4, 3 + len(years) * (len(months) + 1), first_asset_row, last_row_index - 1)
     sb.append_row(cap)
 
+@lru_cache(maxsize=128)
 def _parse_locale_tuple(locale_str: str) -> tuple[str, str]:
     s = (locale_str or "").strip()
     if not s:
@@ -989,18 +1146,37 @@ def add_stylesheet(doc):
     return doc
 
 def initialise_ods(payload: dict) -> dict:
-    params = payload.get("Params") or payload.get("params") or {}
-    conn = payload.get("SqlConnection") or payload.get("sqlConnection") or payload.get("connectionString")
+    # Top-level keys matched case-insensitively (Params/params, SqlConnection/sqlConnection); first non-empty wins
+    top = {}
+    for key, value in payload.items():
+        if value:
+            top.setdefault(key.lower(), value)
+    params = top.get("params") or {}
+    conn = top.get("sqlconnection") or top.get("connectionstring")
     locale = params.get("locale") or "en-GB"
     lang, country = _parse_locale_tuple(locale)
 
-    res = ResourceManager(f"{lang}-{country}")
+    res = get_resource_manager(f"{lang}-{country}")
     repo = create_repo(conn, params)
 
-    active = repo.get_active_period() or {}
-    years = repo.get_active_years()
-    months = repo.get_months()
-    company_name = repo.get_company_name()
+    if "get_export_context" in repo_capabilities(repo):
+        # Period/company lookups batched into one round trip
+        export_context = repo.get_export_context()
+        active = export_context["active"] or {}
+        years = export_context["years"]
+        months = export_context["months"]
+        company_name = export_context["company_name"]
+    else:
+        # Independent lookups run side by side; the repository gives each worker thread its own connection
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            active_f = pool.submit(repo.get_active_period)
+            years_f = pool.submit(repo.get_active_years)
+            months_f = pool.submit(repo.get_months)
+            company_name_f = pool.submit(repo.get_company_name)
+        active = active_f.result() or {}
+        years = years_f.result()
+        months = months_f.result()
+        company_name = company_name_f.result()
 
     include_active = params.get("includeActivePeriods") == "true"
     include_orderbook = params.get("includeOrderBook") == "true"
@@ -1045,84 +1221,101 @@ def build_cashflow_table(sb: SheetBuilder, ctx: dict) -> SheetBuilder:
     include_balance_sheet = ctx["include_balance_sheet"]
 
     # A,B,C
-    colA = Column()
-    colB = Column()
-    colC = Column()
-    colB.set_attribute("table:style-name", "ColBWidth")
-    colC.set_attribute("table:visibility", "collapse")
-    sb.table.append(colA)
-    sb.table.append(colB)
-    sb.table.append(colC)
+    sb.append_column()
+    sb.append_column(style="ColBWidth")
+    sb.append_column(visibility="collapse")
 
     # Append period grid columns (months + totals per year)
     month_count = len(months)
     total_period_cols = len(years) * (month_count + 1)
     for i in range(total_period_cols):
-        col = Column()
         # Totals column in each block gets default borders (applies to blank cells)
         if (i % (month_count + 1)) == month_count:
-            col.set_attribute("table:default-cell-style-name", "TotalsColDefaultCell")
-        sb.table.append(col)
+            sb.append_column(default_cell_style="TotalsColDefaultCell")
+        else:
+            sb.append_column()
 
     # Row 1
-    r1 = Row()
+    r1 = SheetRow()
     title_text = res.t("TextStatementTitle").format(active.get("MonthName", ""), active.get("Description", ""))
     add_spanned_text_cell(r1, title_text, span=3, style="BoldHeaderStyle")
     sb.append_row(r1)
 
     # Row 2
-    r2 = Row()
+    r2 = SheetRow()
     add_spanned_text_cell(r2, company_name or "", span=3, style="BoldHeaderStyle")
     sb.append_row(r2)
 
     # Row 3
-    r3 = Row()
+    r3 = SheetRow()
     add_text_cell(r3, res.t("TextDate"), style="BoldHeaderStyle")
-    add_text_cell(r3, datetime.now().strftime("%d %b %H:%M:%S"), style="BoldHeaderStyle")
-    r3.append(Cell(text=None))
+    add_text_cell(r3, time.strftime("%d %b %H:%M:%S", time.localtime()), style="BoldHeaderStyle")
+    add_empty_cell(r3)
     for y in years:
         desc = y.get("Description") or str(y.get("YearNumber"))
         status = y.get("CashStatus") or ""
         add_spanned_text_cell(r3, f"{desc} ({status})" if status else desc, span=2, style="BoldHeaderStyle")
-        for _ in range(month_count - 2):
-            r3.append(Cell(text=None))
+        add_empty_cells(r3, month_count - 2)
         add_text_cell(r3, desc, style="BoldHeaderStyle")
     sb.append_row(r3)
 
     # Row 4 headers
-    r4 = Row()
+    r4 = SheetRow()
     add_text_cell(r4, res.t("TextCode"), style="Row4HeaderCell")
     add_text_cell(r4, res.t("TextName"), style="Row4HeaderCell")
-    c_cell = Cell(text=None)
-    c_cell.set_attribute("table:style-name", "Row4HeaderCell")
-    r4.append(c_cell)
-    # Month headers use Row4HeaderCell; Totals header uses TotalsColHeaderCell
-    for _ in years:
-        for m in months:
-            add_text_cell(r4, str(m.get("MonthName", "")), style="Row4HeaderCell")
-        add_text_cell(r4, res.t("TextTotals"), style="TotalsColHeaderCell")
+    add_empty_cell(r4, style="Row4HeaderCell")
+    # Month headers use Row4HeaderCell; Totals header uses TotalsColHeaderCell.
+    # The block is the same for every year, so it is built once and repeated
+    header_block = SheetRow()
+    for m in months:
+        add_text_cell(header_block, str(m.get("MonthName", "")), style="Row4HeaderCell")
+    add_text_cell(header_block, res.t("TextTotals"), style="TotalsColHeaderCell")
+    r4.cells.extend(header_block.cells * len(years))
     sb.append_row(r4)
 
     # Sections
+    # The per-cash-type slices are most of the database work and independent of each other, so they load
+    # side by side (the repository gives each worker thread its own connection). Rendering stays in sheet
+    # order on this thread: later blocks reference rows laid out by earlier ones
+    year_numbers = [int(y.get("YearNumber")) for y in years]
+    slice_flags = {
+        CashType.Trade: (include_active, include_orderbook, False),
+        CashType.Money: (False, False, False),
+        CashType.Tax: (include_active, False, include_tax_accruals),
+    }
+    with ThreadPoolExecutor(max_workers=len(slice_flags)) as pool:
+        slice_futures = {ct: pool.submit(repo.get_category_slice, ct, year_numbers, *flags)
+                         for ct, flags in slice_flags.items()}
+        # Category lists for the summary blocks, every cash type in one round trip when the repository supports it
+        cash_types = (CashType.Trade, CashType.Money, CashType.Tax)
+        if "get_categories_by_types" in repo_capabilities(repo):
+            categories_by_type = repo.get_categories_by_types(cash_types)
+        else:
+            categories_by_type = {ct: repo.get_categories(ct) for ct in cash_types}
+    slices = {ct: f.result() for ct, f in slice_futures.items()}
+
     totals_row_by_category: dict[str, int] = {}
-    render_categories_and_summary(sb, repo, res, years, months, CashType.Trade, include_active, include_orderbook, False, totals_row_by_category)
-    render_summary_after_categories(sb, repo, res, years, months, repo.get_categories(CashType.Trade), totals_row_by_category)
+    render_categories_and_summary(sb, repo, res, years, months, CashType.Trade, include_active, include_orderbook, False, totals_row_by_category,
+                                  categories=slices[CashType.Trade])
+    render_summary_after_categories(sb, repo, res, years, months, categories_by_type[CashType.Trade], totals_row_by_category)
 
-    render_categories_and_summary(sb, repo, res, years, months, CashType.Money, False, False, False, totals_row_by_category)
-    render_summary_after_categories(sb, repo, res, years, months, repo.get_categories(CashType.Money), totals_row_by_category)
+    render_categories_and_summary(sb, repo, res, years, months, CashType.Money, False, False, False, totals_row_by_category,
+                                  categories=slices[CashType.Money])
+    render_summary_after_categories(sb, repo, res, years, months, categories_by_type[CashType.Money], totals_row_by_category)
 
     render_summary_totals_block(sb, repo, res, CashType.Trade, totals_row_by_category)
     render_totals_formula(sb, repo, res, years, months, totals_row_by_category)
 
-    render_categories_and_summary(sb, repo, res, years, months, CashType.Tax, include_active, False, include_tax_accruals, totals_row_by_category)
-    render_summary_after_categories(sb, repo, res, years, months, repo.get_categories(CashType.Tax), totals_row_by_category)
+    render_categories_and_summary(sb, repo, res, years, months, CashType.Tax, include_active, False, include_tax_accruals, totals_row_by_category,
+                                  categories=slices[CashType.Tax])
+    render_summary_after_categories(sb, repo, res, years, months, categories_by_type[CashType.Tax], totals_row_by_category)
     render_summary_totals_block(sb, repo, res, CashType.Tax, totals_row_by_category)
 
     render_expressions(sb, repo, res, years, months, totals_row_by_category)
 
     if include_bank_balances:
         render_bank_balances(sb, repo, res, years, months)
-        sb.append_row(Row())
+        sb.append_empty_row()
 
     if include_vat_details:
         render_vat_recurrence_totals(sb, repo, res, years, months, include_active, include_tax_accruals)
@@ -1133,7 +1326,15 @@ def build_cashflow_table(sb: SheetBuilder, ctx: dict) -> SheetBuilder:
 
     return sb
 
-def save_cashflow(doc: Document, ctx: dict) -> tuple[str, bytes]:
+def _splice_sheet_xml(content_xml: bytes, sheet_xml: str) -> bytes:
+    # Append the sheet as the last child of office:spreadsheet, byte-level, without loading a DOM
+    close_tag = b"</office:spreadsheet>"
+    idx = content_xml.rfind(close_tag)
+    if idx < 0:
+        return content_xml.replace(b"<office:spreadsheet/>", b"<office:spreadsheet>" + sheet_xml.encode("utf-8") + close_tag, 1)
+    return content_xml[:idx] + sheet_xml.encode("utf-8") + content_xml[idx:]
+
+def save_cashflow(doc: Document, ctx: dict, sheet_xml: Optional[str] = None) -> tuple[str, bytes]:
     table_name = ctx["table_name"]
     lang = ctx["lang"]
     country = ctx["country"]
@@ -1148,54 +1349,79 @@ def save_cashflow(doc: Document, ctx: dict) -> tuple[str, bytes]:
     except TypeError:
         content = doc.save()
 
-    # 1) Materialize semantic styles (NUM/PCT/CASH, maps, etc.)
-    content = apply_styles_bytes(content, locale=(lang, country), strip_defaults=True)
+    # Sheet built as XML text goes straight into content.xml; the style pass below writes the package once
+    content_xml = None
+    if sheet_xml is not None:
+        with zipfile.ZipFile(io.BytesIO(content), "r") as zin:
+            content_xml = _splice_sheet_xml(zin.read("content.xml"), sheet_xml)
 
-    # 2) Column-first totals borders 
+    # 1) Materialize semantic styles (NUM/PCT/CASH, maps, etc.)
+    # 2) Column-first totals borders, applied to the same parsed content tree before it is serialized
     months = ctx["months"]
     years = ctx["years"]
-    content = _post_process_totals_borders(content, month_count=len(months), years_count=len(years))
+    parts = apply_styles_parts(
+        content, locale=(lang, country), strip_defaults=True, content_xml=content_xml,
+        content_hook=lambda root: _post_process_totals_borders(root, month_count=len(months), years_count=len(years)),
+        content_tree=True,
+    )
 
-    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    # 3) One package write for all rewritten parts
+    content = _write_ods_package(content, parts)
+
+    ts = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
     return f"Cash_Flow_{ts}.ods", content
 
-def _post_process_totals_borders(content: bytes, month_count: int, years_count: int) -> bytes:
-    import io, zipfile, re
+# content.xml namespaces and the qualified names _post_process_totals_borders reads and writes, built once
+_ODS_NS = {
+    'office': 'urn:oasis:names:tc:opendocument:xmlns:office:1.0',
+    'style': 'urn:oasis:names:tc:opendocument:xmlns:style:1.0',
+    'table': 'urn:oasis:names:tc:opendocument:xmlns:table:1.0',
+    'text': 'urn:oasis:names:tc:opendocument:xmlns:text:1.0',
+    'number': 'urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0',
+    'fo': 'urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0',
+}
+_FO_BORDER_LEFT = f"{{{_ODS_NS['fo']}}}border-left"
+_FO_BORDER_RIGHT = f"{{{_ODS_NS['fo']}}}border-right"
+_OFFICE_VALUE = f"{{{_ODS_NS['office']}}}value"
+_OFFICE_VALUE_TYPE = f"{{{_ODS_NS['office']}}}value-type"
+_STYLE_STYLE = f"{{{_ODS_NS['style']}}}style"
+_STYLE_NAME = f"{{{_ODS_NS['style']}}}name"
+_STYLE_FAMILY = f"{{{_ODS_NS['style']}}}family"
+_STYLE_PARENT_STYLE_NAME = f"{{{_ODS_NS['style']}}}parent-style-name"
+_STYLE_TABLE_CELL_PROPERTIES = f"{{{_ODS_NS['style']}}}table-cell-properties"
+_TABLE_ROW = f"{{{_ODS_NS['table']}}}table-row"
+_TABLE_CELL = f"{{{_ODS_NS['table']}}}table-cell"
+_TABLE_STYLE_NAME = f"{{{_ODS_NS['table']}}}style-name"
+_TABLE_FORMULA = f"{{{_ODS_NS['table']}}}formula"
+_TABLE_DEFAULT_CELL_STYLE_NAME = f"{{{_ODS_NS['table']}}}default-cell-style-name"
+_TABLE_COLUMNS_REPEATED = f"{{{_ODS_NS['table']}}}number-columns-repeated"
+_TABLE_ROWS_REPEATED = f"{{{_ODS_NS['table']}}}number-rows-repeated"
+# Table cells of a row (covered cells excluded)
+_XP_ROW_CELLS = etree.XPath('table:table-cell', namespaces=_ODS_NS)
+
+def _post_process_totals_borders(root, month_count: int, years_count: int) -> None:
+    # Mutates the parsed content.xml root in place; runs inside the style pass so content.xml is parsed
+    # and serialized once (see save_cashflow)
+    import re
     from lxml import etree as ET
 
-    src_zip = zipfile.ZipFile(io.BytesIO(content), 'r')
-    namelist = src_zip.namelist()
-    if 'content.xml' not in namelist:
-        src_zip.close()
-        return content
-    content_xml = src_zip.read('content.xml')
-
-    ns = {
-        'office': 'urn:oasis:names:tc:opendocument:xmlns:office:1.0',
-        'style': 'urn:oasis:names:tc:opendocument:xmlns:style:1.0',
-        'table': 'urn:oasis:names:tc:opendocument:xmlns:table:1.0',
-        'text': 'urn:oasis:names:tc:opendocument:xmlns:text:1.0',
-        'number': 'urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0',
-        'fo': 'urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0',
-    }
-    root = ET.fromstring(content_xml)
+    ns = _ODS_NS
     auto_styles = root.find('office:automatic-styles', ns)
     if auto_styles is None:
-        src_zip.close()
-        return content
+        return
 
     def ensure_totals_default():
         existing = auto_styles.find("style:style[@style:name='TotalsColDefaultCell'][@style:family='table-cell']", ns)
         if existing is not None:
             return
-        st = ET.Element(f"{{{ns['style']}}}style", {
-            f"{{{ns['style']}}}name": "TotalsColDefaultCell",
-            f"{{{ns['style']}}}family": "table-cell",
-            f"{{{ns['style']}}}parent-style-name": "Default"
+        st = ET.Element(_STYLE_STYLE, {
+            _STYLE_NAME: "TotalsColDefaultCell",
+            _STYLE_FAMILY: "table-cell",
+            _STYLE_PARENT_STYLE_NAME: "Default"
         })
-        props = ET.Element(f"{{{ns['style']}}}table-cell-properties")
-        props.set(f"{{{ns['fo']}}}border-left", "0.5pt solid #000000")
-        props.set(f"{{{ns['fo']}}}border-right", "1.5pt solid #000000")
+        props = ET.Element(_STYLE_TABLE_CELL_PROPERTIES)
+        props.set(_FO_BORDER_LEFT, "0.5pt solid #000000")
+        props.set(_FO_BORDER_RIGHT, "1.5pt solid #000000")
         st.append(props)
         auto_styles.append(st)
 
@@ -1210,13 +1436,13 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
         if src is None:
             return src_style_name
         new = ET.fromstring(ET.tostring(src))
-        new.set(f"{{{ns['style']}}}name", new_name)
+        new.set(_STYLE_NAME, new_name)
         props = new.find('style:table-cell-properties', ns)
         if props is None:
-            props = ET.Element(f"{{{ns['style']}}}table-cell-properties")
+            props = ET.Element(_STYLE_TABLE_CELL_PROPERTIES)
             new.append(props)
-        props.set(f"{{{ns['fo']}}}border-left", "0.5pt solid #000000")
-        props.set(f"{{{ns['fo']}}}border-right", "1.5pt solid #000000")
+        props.set(_FO_BORDER_LEFT, "0.5pt solid #000000")
+        props.set(_FO_BORDER_RIGHT, "1.5pt solid #000000")
         auto_styles.append(new)
         return new_name
 
@@ -1226,21 +1452,46 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
             idx = idx * 26 + (ord(ch) - ord('A') + 1)
         return idx
 
-    def find_cell_by_index(row_elem: ET._Element, col_index_1based: int):
-        count = 0
-        for child in row_elem:
-            if not hasattr(child, 'tag'):
-                continue
-            tag = child.tag
-            if not (tag.endswith('table-cell') or tag.endswith('covered-table-cell')):
-                continue
-            repeat = int(child.get(f"{{{ns['table']}}}number-columns-repeated", "1"))
-            next_count = count + repeat
-            if col_index_1based <= next_count:
-                return child
-            count = next_count
+    # Row number -> cell element per visual column (repeats expanded, covered cells included), built the
+    # first time a formula references the row; every later reference is a list index
+    cells_by_row: dict[int, list] = {}
+
+    def cell_at(row_num: int, col_index_1based: int):
+        if not 1 <= row_num <= len(rows):
+            return None
+        cells = cells_by_row.get(row_num)
+        if cells is None:
+            cells = []
+            for child in rows[row_num - 1]:
+                if not hasattr(child, 'tag'):
+                    continue
+                tag = child.tag
+                if not (tag.endswith('table-cell') or tag.endswith('covered-table-cell')):
+                    continue
+                repeat = int(child.get(_TABLE_COLUMNS_REPEATED, "1"))
+                cells.extend([child] * repeat)
+            cells_by_row[row_num] = cells
+        if 1 <= col_index_1based <= len(cells):
+            return cells[col_index_1based - 1]
         return None
 
+    # Parsed office:value per referenced cell (None when absent or not a number). Totals are summed from the
+    # same cells many times over; a formula cell's entry is refreshed when its cached value is written below
+    parsed_values: dict = {}
+
+    def cell_value(c) -> Optional[float]:
+        if c in parsed_values:
+            return parsed_values[c]
+        v = c.get(_OFFICE_VALUE)
+        f = None
+        if v is not None:
+            try:
+                f = float(v)
+            except ValueError:
+                pass
+        parsed_values[c] = f
+        return f
+
     def is_totals_col(col_index_1based: int) -> bool:
         rel = col_index_1based - 4  # D=4 starts period grid
         if rel < 0:
@@ -1252,12 +1503,11 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
         m = re.match(r'^(CASH\d+)_(?:POS_|NEG_)?CELL(?:_BORDERED)?$', (style_name or '').upper())
         return m.group(1) if m else None
 
-    ensure_totals_default()
-
     table = root.find('.//table:table', ns)
     if table is None:
-        src_zip.close()
-        return content
+        return
+
+    ensure_totals_default()
 
     total_period_cols = years_count * (month_count + 1)
     total_visual_cols = 3 + total_period_cols
@@ -1268,25 +1518,11 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
         if col_1based - 1 >= len(cols):
             break
         if (i % (month_count + 1)) == month_count:
-            cols[col_1based - 1].set(f"{{{ns['table']}}}default-cell-style-name", "TotalsColDefaultCell")
+            cols[col_1based - 1].set(_TABLE_DEFAULT_CELL_STYLE_NAME, "TotalsColDefaultCell")
 
     rows = table.findall('table:table-row', ns)
 
-    # 1) Bordered clones for explicitly styled totals-column cells
-    for row in rows:
-        cells = row.findall('table:table-cell', ns)
-        for col_index_1based, cell in enumerate(cells, start=1):
-            if cell.tag.endswith('covered-table-cell'):
-                continue
-            if not is_totals_col(col_index_1based):
-                continue
-            sname = cell.get(f"{{{ns['table']}}}style-name") or ""
-            if sname:
-                bordered = ensure_bordered_clone(sname)
-                if bordered and bordered != sname:
-                    cell.set(f"{{{ns['table']}}}style-name", bordered)
-
-    # 2) Compute cached values: direct refs, SUM row-ranges, simple +/- refs, and SUM down a column
+    # Cached values: direct refs, SUM row-ranges, simple +/- refs, and SUM down a column
     direct_ref_patterns = [
         re.compile(r"^of:=\.?\$?([A-Za-z]+)\$?(\d+)$"),
         re.compile(r"^of:=\[\.\$?([A-Za-z]+)\$?(\d+)\]$"),
@@ -1302,142 +1538,113 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
     ]
     add_sub_pat = re.compile(r'([+\-]?)\s*(?:\[\.\$?([A-Za-z]+)\$?(\d+)\]|\$?([A-Za-z]+)\$?(\d+))')
 
-    for row in rows:
-        cells = row.findall('table:table-cell', ns)
-        for c_idx, cell in enumerate(cells, start=1):
-            if not is_totals_col(c_idx):
-                continue
-            formula = cell.get(f"{{{ns['table']}}}formula")
-            if not formula:
-                continue
+    def direct_ref_value(m) -> Optional[float]:
+        col_letters, row_num = m.group(1), int(m.group(2))
+        ref_cell = cell_at(row_num, col_letters_to_index(col_letters))
+        return cell_value(ref_cell) if ref_cell is not None else None
+
+    def sum_row_value(m) -> Optional[float]:
+        # SUM of row-range (same row)
+        start_col, row_num, end_col = m.group(1), int(m.group(2)), m.group(3)
+        mult = -1.0 if (m.group(4) or "") == "*-1" else 1.0
+        if not 1 <= row_num <= len(rows):
+            return None
+        start_ci = col_letters_to_index(start_col)
+        end_ci = col_letters_to_index(end_col)
+        if end_ci < start_ci:
+            start_ci, end_ci = end_ci, start_ci
+        total = 0.0
+        for ci in range(start_ci, end_ci + 1):
+            rc = cell_at(row_num, ci)
+            f = cell_value(rc) if rc is not None else None
+            if f is not None:
+                total += f
+        return total * mult
+
+    def sum_col_value(m) -> Optional[float]:
+        # SUM down a column between two row indices (category totals)
+        col_letters, start_row_num, end_row_num = m.group(1), int(m.group(2)), int(m.group(3))
+        mult = -1.0 if (m.group(4) or "") == "*-1" else 1.0
+        ref_ci = col_letters_to_index(col_letters)
+        total = 0.0
+        for rnum in range(min(start_row_num, end_row_num), max(start_row_num, end_row_num) + 1):
+            rc = cell_at(rnum, ref_ci)
+            f = cell_value(rc) if rc is not None else None
+            if f is not None:
+                total += f
+        return total * mult
+
+    # Formula families in match order. Only SUM( formulas can match the SUM families and none of them can be a
+    # direct ref, so the "of:=SUM(" prefix picks the families to try instead of running every pattern
+    sum_families = ((sum_row_patterns, sum_row_value), (sum_col_patterns, sum_col_value))
+    ref_families = ((direct_ref_patterns, direct_ref_value),)
+
+    def cached_value(formula: str) -> Optional[float]:
+        # Value Calc would show for the formula, or None when it is not one of the recognised shapes
+        for patterns, evaluate in (sum_families if formula.startswith("of:=SUM(") else ref_families):
+            # First matching pattern of a family decides it; an unresolved family falls through to the next
             computed = None
-
-            # Direct ref
-            for pat in direct_ref_patterns:
+            for pat in patterns:
                 m = pat.match(formula)
                 if m:
-                    col_letters, row_num = m.group(1), int(m.group(2))
-                    ref_col = col_letters_to_index(col_letters)
-                    ref_row = rows[row_num - 1] if 1 <= row_num <= len(rows) else None
-                    ref_cell = find_cell_by_index(ref_row, ref_col) if ref_row is not None else None
-                    if ref_cell is not None:
-                        v = ref_cell.get(f"{{{ns['office']}}}value")
-                        if v is not None:
-                            try:
-                                computed = float(v)
-                            except ValueError:
-                                pass
+                    computed = evaluate(m)
                     break
             if computed is not None:
-                cell.set(f"{{{ns['office']}}}value-type", "float")
-                cell.set(f"{{{ns['office']}}}value", str(computed))
-                continue
-
-            # SUM of row-range (same row)
-            for pat in sum_row_patterns:
-                m = pat.match(formula)
-                if not m:
-                    continue
-                start_col, row_num, end_col = m.group(1), int(m.group(2)), m.group(3)
-                mult = -1.0 if (m.group(4) or "") == "*-1" else 1.0
-                if 1 <= row_num <= len(rows):
-                    start_ci = col_letters_to_index(start_col)
-                    end_ci = col_letters_to_index(end_col)
-                    if end_ci < start_ci:
-                        start_ci, end_ci = end_ci, start_ci
-                    ref_row = rows[row_num - 1]
-                    total = 0.0
-                    for ci in range(start_ci, end_ci + 1):
-                        rc = find_cell_by_index(ref_row, ci)
-                        if rc is None:
-                            continue
-                        v = rc.get(f"{{{ns['office']}}}value")
-                        if v is None:
-                            continue
-                        try:
-                            total += float(v)
-                        except ValueError:
-                            continue
-                    computed = total * mult
-                    break
-            if computed is not None:
-                cell.set(f"{{{ns['office']}}}value-type", "float")
-                cell.set(f"{{{ns['office']}}}value", str(computed))
-                continue
-
-            # SUM down a column between two row indices (category totals)
-            for pat in sum_col_patterns:
-                m = pat.match(formula)
-                if not m:
-                    continue
-                col_letters, start_row_num, end_row_num = m.group(1), int(m.group(2)), int(m.group(3))
-                mult = -1.0 if (m.group(4) or "") == "*-1" else 1.0
-                ref_ci = col_letters_to_index(col_letters)
-                total = 0.0
-                for rnum in range(min(start_row_num, end_row_num), max(start_row_num, end_row_num) + 1):
-                    ref_row = rows[rnum - 1] if 1 <= rnum <= len(rows) else None
-                    rc = find_cell_by_index(ref_row, ref_ci) if ref_row is not None else None
-                    if rc is None:
-                        continue
-                    v = rc.get(f"{{{ns['office']}}}value")
-                    if v is None:
-                        continue
-                    try:
-                        total += float(v)
-                    except ValueError:
-                        continue
-                computed = total * mult
-                break
-            if computed is not None:
-                cell.set(f"{{{ns['office']}}}value-type", "float")
-                cell.set(f"{{{ns['office']}}}value", str(computed))
-                continue
-
-            # +/- list of refs
-            total = 0.0
-            matched = False
-            for sign, c1, r1, c2, r2 in add_sub_pat.findall(formula):
-                matched = True
-                col_letters = c1 or c2
-                row_num = int(r1 or r2)
-                ref_col = col_letters_to_index(col_letters)
-                rc_row = rows[row_num - 1] if 1 <= row_num <= len(rows) else None
-                rc = find_cell_by_index(rc_row, ref_col) if rc_row is not None else None
-                if rc is None:
-                    continue
-                v = rc.get(f"{{{ns['office']}}}value")
-                if v is None:
-                    continue
-                try:
-                    valf = float(v)
-                except ValueError:
-                    continue
+                return computed
+
+        # +/- list of refs
+        total = 0.0
+        matched = False
+        for sign, c1, r1, c2, r2 in add_sub_pat.findall(formula):
+            matched = True
+            col_letters = c1 or c2
+            row_num = int(r1 or r2)
+            ref_col = col_letters_to_index(col_letters)
+            rc = cell_at(row_num, ref_col)
+            valf = cell_value(rc) if rc is not None else None
+            if valf is not None:
                 total += (-valf if sign == '-' else valf)
-            if matched:
-                cell.set(f"{{{ns['office']}}}value-type", "float")
-                cell.set(f"{{{ns['office']}}}value", str(total))
+        return total if matched else None
 
-    # 3) Enforce CASH POS/NEG bordered style from cached value
+    # One pass over the totals-column cells. Each cell is finished before the next row is read: a formula only
+    # reads the office:value of the cells it references, and the styling steps never change a value
     for row in rows:
-        cells = row.findall('table:table-cell', ns)
-        for col_index_1based, cell in enumerate(cells, start=1):
+        for col_index_1based, cell in enumerate(_XP_ROW_CELLS(row), start=1):
             if not is_totals_col(col_index_1based):
                 continue
-            val_str = cell.get(f"{{{ns['office']}}}value")
-            vtype = cell.get(f"{{{ns['office']}}}value-type")
+
+            # 1) Bordered clone for an explicitly styled totals-column cell
+            sname = cell.get(_TABLE_STYLE_NAME) or ""
+            if sname:
+                bordered = ensure_bordered_clone(sname)
+                if bordered and bordered != sname:
+                    cell.set(_TABLE_STYLE_NAME, bordered)
+
+            # 2) Cached value for formula cells
+            formula = cell.get(_TABLE_FORMULA)
+            if formula:
+                computed = cached_value(formula)
+                if computed is not None:
+                    cell.set(_OFFICE_VALUE_TYPE, "float")
+                    cell.set(_OFFICE_VALUE, str(computed))
+                    parsed_values[cell] = computed
+
+            # 3) Enforce CASH POS/NEG bordered style from cached value
+            val_str = cell.get(_OFFICE_VALUE)
+            vtype = cell.get(_OFFICE_VALUE_TYPE)
             if vtype != "float" or val_str is None:
                 continue
             try:
                 num = float(val_str)
             except ValueError:
                 continue
-            sname = (cell.get(f"{{{ns['table']}}}style-name") or "").upper()
+            sname = (cell.get(_TABLE_STYLE_NAME) or "").upper()
             root_name = cash_root(sname)
             if not root_name:
                 continue
             pos = ensure_bordered_clone(f"{root_name}_POS_CELL")
             neg = ensure_bordered_clone(f"{root_name}_NEG_CELL")
-            cell.set(f"{{{ns['table']}}}style-name", neg if num < 0 else pos)
+            cell.set(_TABLE_STYLE_NAME, neg if num < 0 else pos)
 
     # 4) Normalize spacer/short rows
     for row in rows:
@@ -1450,68 +1657,97 @@ def _post_process_totals_borders(content: bytes, month_count: int, years_count:
             tag = child.tag
             if not (tag.endswith('table-cell') or tag.endswith('covered-table-cell')):
                 continue
-            repeat = int(child.get(f"{{{ns['table']}}}number-columns-repeated", "1"))
+            repeat = int(child.get(_TABLE_COLUMNS_REPEATED, "1"))
             visual_cols += repeat
         if visual_cols < total_visual_cols:
             deficit = total_visual_cols - visual_cols
-            rc = ET.Element(f"{{{ns['table']}}}table-cell")
-            rc.set(f"{{{ns['table']}}}number-columns-repeated", str(deficit))
+            rc = ET.Element(_TABLE_CELL)
+            rc.set(_TABLE_COLUMNS_REPEATED, str(deficit))
             row.append(rc)
 
     # 5) End-of-sheet repeater
-    rep = ET.Element(f"{{{ns['table']}}}table-row")
-    rep.set(f"{{{ns['table']}}}number-rows-repeated", "1048568")
-    rep_cell = ET.Element(f"{{{ns['table']}}}table-cell")
-    rep_cell.set(f"{{{ns['table']}}}number-columns-repeated", str(total_visual_cols))
+    rep = ET.Element(_TABLE_ROW)
+    rep.set(_TABLE_ROWS_REPEATED, "1048568")
+    rep_cell = ET.Element(_TABLE_CELL)
+    rep_cell.set(_TABLE_COLUMNS_REPEATED, str(total_visual_cols))
     rep.append(rep_cell)
     table.append(rep)
 
-    # Final defensive cleanup
-    for elem in root.iter():
-        for child in list(elem):
-            if not hasattr(child, 'tag'):
-                elem.remove(child)
-
-    new_content_xml = ET.tostring(root, encoding='UTF-8', xml_declaration=True)
+def _ods_compresslevel() -> int:
+    # Deflate level for the written package; 0 stores entries uncompressed. Level 1 gets most of the size
+    # reduction (the base64 result is piped back to the caller) for little CPU. Override: TC_ODS_COMPRESSLEVEL
+    try:
+        return min(9, max(0, int(os.environ.get("TC_ODS_COMPRESSLEVEL", "1"))))
+    except ValueError:
+        return 1
 
-    entries = {}
-    for name in namelist:
-        if name == 'content.xml':
-            continue
-        entries[name] = src_zip.read(name)
-    src_zip.close()
+def _write_part(zf: zipfile.ZipFile, name: str, data: Union[bytes, etree._Element]) -> None:
+    if isinstance(data, bytes):
+        zf.writestr(name, data)
+        return
+    # A parsed part is serialized straight into its entry: the document is never held as one bytes object
+    with zf.open(name, "w") as fh:
+        etree.ElementTree(data).write(fh, xml_declaration=True, encoding="UTF-8")
 
+def _write_ods_package(ods_bytes: bytes, replacements: dict[str, Union[bytes, etree._Element]]) -> bytes:
+    """
+    Write the final package in one pass: mimetype first and stored (ODF requirement), then content.xml,
+    then the remaining entries of ods_bytes in their original order, with replacements substituted.
+    A replacement may be a parsed root element, which is serialized directly into the zip entry.
+    """
+    level = _ods_compresslevel()
+    compression = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
     out = io.BytesIO()
-    with zipfile.ZipFile(out, 'w') as zf:
-        if 'mimetype' in entries:
+    with zipfile.ZipFile(io.BytesIO(ods_bytes), 'r') as zin, \
+            zipfile.ZipFile(out, 'w', compression=compression, compresslevel=level if level else None) as zf:
+        names = zin.namelist()
+        if 'mimetype' in names:
             zi = zipfile.ZipInfo('mimetype')
             zi.compress_type = zipfile.ZIP_STORED
-            zf.writestr(zi, entries['mimetype'])
-            del entries['mimetype']
-        zf.writestr('content.xml', new_content_xml)
-        for name, data in entries.items():
-            zf.writestr(name, data)
-
+            zf.writestr(zi, zin.read('mimetype'))
+        if 'content.xml' in replacements or 'content.xml' in names:
+            _write_part(zf, 'content.xml', replacements['content.xml'] if 'content.xml' in replacements else zin.read('content.xml'))
+        for name in names:
+            if name in ('mimetype', 'content.xml'):
+                continue
+            _write_part(zf, name, replacements[name] if name in replacements else zin.read(name))
+        for name, data in replacements.items():
+            if name not in names and name != 'content.xml':
+                _write_part(zf, name, data)
     return out.getvalue()
 
 def generate_ods(payload: dict) -> tuple[str, bytes]:
 
     ctx = initialise_ods(payload)
+    try:
+        doc = Document("spreadsheet")
+        doc = add_stylesheet(doc)
 
-    doc = Document("spreadsheet")
-    doc = add_stylesheet(doc)
+        sb = SheetBuilder(name=ctx["table_name"])
+        sb = build_cashflow_table(sb, ctx)
 
-    sb = SheetBuilder(name=ctx["table_name"])
-    sb = build_cashflow_table(sb, ctx)
+        return save_cashflow(doc, ctx, sheet_xml=sb.to_xml())
+    finally:
+        ctx["repo"].close()
 
-    doc.body.append(sb.table)
-    return save_cashflow(doc, ctx)
+def _load_payload(data: bytes) -> dict:
+    # UTF-8 JSON bytes, BOM tolerated (as utf-8-sig reading did)
+    if data.startswith(b"\xef\xbb\xbf"):
+        data = data[3:]
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 if __name__ == "__main__":
     if len(sys.argv) >= 2:
-        with open(sys.argv[1], "r", encoding="utf-8-sig") as f:
-            payload = json.load(f)
+        with open(sys.argv[1], "rb") as f:
+            payload = _load_payload(f.read())
     else:
-        payload = json.loads(sys.stdin.read())
+        payload = _load_payload(sys.stdin.buffer.read())
     filename, content = generate_ods(payload)
-    print(f"{filename}|{base64.b64encode(content).decode('ascii')}")
\ No newline at end of file
+    # filename|base64 written as bytes: the encoded package never becomes a Python str
+    out = sys.stdout.buffer
+    out.write(filename.encode("utf-8") + b"|")
+    out.write(base64.b64encode(content))
+    out.write(b"\n")
+    out.flush()
\ No newline at end of file
@@ -26,4 +26,14 @@ class ResourceManager:
 
     def t(self, key: str) -> str:
         """Translate a key, falling back to the key name if missing."""
-        return self._cache.get(key, key)
\ No newline at end of file
+        return self._cache.get(key, key)
+
+# Loaded managers per locale, kept for the life of the process (resources are read-only once loaded)
+_MANAGERS: Dict[str, ResourceManager] = {}
+
+def get_resource_manager(locale: str = "en-GB") -> ResourceManager:
+    """Shared ResourceManager for a locale; the JSON file is read on first use only."""
+    rm = _MANAGERS.get(locale)
+    if rm is None:
+        rm = _MANAGERS.setdefault(locale, ResourceManager(locale))
+    return rm
\ No newline at end of file
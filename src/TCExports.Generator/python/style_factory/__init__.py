@@ -1,3 +1,3 @@
-﻿from .engine import apply_styles_bytes
+﻿from .engine import apply_styles_bytes, apply_styles_parts
 
-__all__ = ["apply_styles_bytes"]
\ No newline at end of file
+__all__ = ["apply_styles_bytes", "apply_styles_parts"]
\ No newline at end of file
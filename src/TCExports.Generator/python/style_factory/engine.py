@@ -1,10 +1,10 @@
 ﻿from __future__ import annotations
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import Callable, Dict, Optional, Tuple, Union
 import io
 import zipfile
 
-from .rendering.injector import inject_content_styles, apply_default_language_to_styles
+from .rendering.injector import inject_content_styles_root, apply_default_language_to_styles
 from .rendering.ods_repack import repack_with_replacements
 from lxml import etree as ET
 from .rendering.xml_utils import OFFICE_NS, q
@@ -35,9 +35,30 @@ def apply_styles_bytes(
     ods_bytes: bytes,
     locale: Locale = ("en", "GB"),
     strip_defaults: bool = True,
+    content_xml: Optional[bytes] = None,
 ) -> bytes:
+    # content_xml, when given, replaces the package's content.xml (lets callers splice it without a repack)
+    return repack_with_replacements(
+        ods_bytes,
+        replacements=apply_styles_parts(ods_bytes, locale=locale, strip_defaults=strip_defaults, content_xml=content_xml),
+    )
+
+def apply_styles_parts(
+    ods_bytes: bytes,
+    locale: Locale = ("en", "GB"),
+    strip_defaults: bool = True,
+    content_xml: Optional[bytes] = None,
+    content_hook: Optional[Callable[[ET._Element], None]] = None,
+    content_tree: bool = False,
+) -> Dict[str, Union[bytes, ET._Element]]:
+    # Same rewrite as apply_styles_bytes, returned as the replaced parts (content.xml, styles.xml, meta.xml)
+    # for callers that post-process them and write the package themselves. content_hook, when given, is
+    # called with the styled content root before it is serialized, so further edits need no re-parse.
+    # content_tree returns content.xml as that root instead of bytes, for writers that serialize it
+    # straight into the package entry
     with zipfile.ZipFile(io.BytesIO(ods_bytes), "r") as zin:
-        content_xml = zin.read("content.xml")
+        if content_xml is None:
+            content_xml = zin.read("content.xml")
         try:
             styles_xml = zin.read("styles.xml")
         except KeyError:
@@ -48,15 +69,16 @@ def apply_styles_bytes(
             meta_xml = None
 
     lang, country = locale
-    new_content_xml = inject_content_styles(content_xml, strip_defaults=strip_defaults, lang=lang, country=country)
+    content_root = ET.fromstring(content_xml, parser=ET.XMLParser(remove_blank_text=False))
+    inject_content_styles_root(content_root, strip_defaults=strip_defaults, lang=lang, country=country)
+    if content_hook is not None:
+        content_hook(content_root)
+    new_content_xml = content_root if content_tree else ET.tostring(content_root, xml_declaration=True, encoding="UTF-8")
     new_styles_xml = apply_default_language_to_styles(styles_xml, lang=lang, country=country)
     new_meta_xml = _apply_meta_locale(meta_xml, lang=lang, country=country)
 
-    return repack_with_replacements(
-        ods_bytes,
-        replacements={
-            "content.xml": new_content_xml,
-            "styles.xml": new_styles_xml,
-            "meta.xml": new_meta_xml,
-        },
-    )
\ No newline at end of file
+    return {
+        "content.xml": new_content_xml,
+        "styles.xml": new_styles_xml,
+        "meta.xml": new_meta_xml,
+    }
\ No newline at end of file
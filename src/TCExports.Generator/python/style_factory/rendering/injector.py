@@ -10,7 +10,11 @@ from ..mapping.registry import StyleRegistry, DataStyleSpec, CellStyleSpec
 def inject_content_styles(content_xml: bytes, strip_defaults: bool = True, lang: str = "en", country: str = "GB") -> bytes:
     parser = ET.XMLParser(remove_blank_text=False)
     root = ET.fromstring(content_xml, parser=parser)
+    inject_content_styles_root(root, strip_defaults=strip_defaults, lang=lang, country=country)
+    return ET.tostring(root, xml_declaration=True, encoding="UTF-8")
 
+def inject_content_styles_root(root: ET._Element, strip_defaults: bool = True, lang: str = "en", country: str = "GB") -> None:
+    # In-place form of inject_content_styles for callers that keep working on the parsed tree
     auto = root.find(q(OFFICE_NS, "automatic-styles"))
     if auto is None:
         auto = ET.Element(q(OFFICE_NS, "automatic-styles"))
@@ -164,8 +168,6 @@ def inject_content_styles(content_xml: bytes, strip_defaults: bool = True, lang:
         if neg in neg_cells:
             ensure_cash_base_cell_style_with_maps(base, pos, neg)
 
-    return ET.tostring(root, xml_declaration=True, encoding="UTF-8")
-
 def apply_default_language_to_styles(
     styles_xml: Optional[bytes],
     lang: str = "en",